@@ -0,0 +1,238 @@
+'''
+Offline benchmarks
+Run from the project root, e.g. python src/benchmark.py memory
+'''
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+import crossref
+import evaluation
+
+CONFIG_PATH = Path(__file__).resolve().parent.parent.joinpath("example-config.json")
+FLAT_PEAK_MIB = 8 # Largest growth in the bounded evaluator's peak RSS across sizes still counted as flat
+WORDS = ("adaptive", "analysis", "compiler", "dynamic", "efficient", "framework", "graph", "incremental",
+         "language", "learning", "memory", "model", "network", "optimisation", "parallel", "program",
+         "query", "runtime", "scalable", "semantic", "static", "system", "trace", "type", "verification")
+SURNAMES = ("Smith", "Garcia", "Chen", "Müller", "Okafor", "Ivanova", "Tanaka", "Dubois", "Kowalski", "Silva")
+
+"""
+Writes a synthetic Grobid XML file with the given number of references
+Parameters:
+    path (Path): Output file
+    count (int): Number of references
+    seed (int): Random seed, the same seed always produces the same file
+Returns: None
+"""
+def synthetic_tei(path, count, seed=1):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf8") as tei:
+        tei.write('<TEI xmlns="http://www.tei-c.org/ns/1.0">\n<text><back><div><listBibl>\n')
+        for i in range(count):
+            title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 10))).capitalize()
+            authors = "".join('<author><persName><forename type="first">%s</forename><surname>%s</surname></persName></author>'
+                              % (chr(65 + rng.randrange(26)), rng.choice(SURNAMES)) for _ in range(rng.randint(1, 4)))
+            first = rng.randint(1, 900)
+            tei.write('<biblStruct xml:id="b%d"><analytic><title level="a" type="main">%s</title>%s'
+                      '<idno type="DOI">10.5555/synthetic.%d</idno></analytic><monogr><title level="j">Journal of %s</title>'
+                      '<imprint><biblScope unit="volume">%d</biblScope><biblScope unit="page" from="%d" to="%d"/>'
+                      '<date type="published" when="%d"/></imprint></monogr></biblStruct>\n'
+                      % (i, title, authors, i, rng.choice(WORDS).capitalize(), rng.randint(1, 60), first,
+                         first + rng.randint(1, 30), rng.randint(1970, 2025)))
+        tei.write('</listBibl></div></back></text>\n</TEI>\n')
+
+"""
+Stands in for the habanero Crossref client, answering every query with a synthetic record of realistic size
+Methods:
+    works(ids, **query):
+        Returns a Crossref style response
+"""
+class StubCrossref:
+    def __init__(self, **options): # Accepts the habanero client's mailto and timeout
+        self.options = options
+
+    def works(self, ids=None, **query):
+        doi = ids if ids is not None else "10.5555/query.%d" % zlib.crc32(repr(sorted(query.items())).encode())
+        record = {"DOI": doi, "title": ["Synthetic record %s" % doi], "type": "journal-article",
+                  "author": [{"given": "A", "family": name} for name in SURNAMES[:3]],
+                  "container-title": ["Journal of Synthetic Records"], "published": {"date-parts": [[2000]]},
+                  "reference": [{"key": "%s-%d" % (doi, i), "unstructured": " ".join(WORDS)} for i in range(15)]}
+        if ids is not None:
+            return {"status": "ok", "message": record}
+        return {"status": "ok", "message": {"items": [record]}}
+
+"""
+Swaps a searcher's Crossref client class for StubCrossref, so runs go through its stages and cache without network access
+Parameters:
+    searcher (CrossrefSearcher): Searcher to stub
+Returns:
+    CrossrefSearcher: The same searcher
+"""
+def stub_transport(searcher):
+    searcher.transport = StubCrossref
+    return searcher
+
+"""
+Returns the peak resident set size of the current process
+Parameters: None
+Returns:
+    float: Peak RSS in MiB
+"""
+def peak_rss():
+    import resource # Unix only
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024 # Bytes on macOS, KiB elsewhere
+
+"""
+Evaluates a file in the current process with a stubbed Crossref transport and reports its cost, run in a child process by memory_benchmark
+Parameters:
+    path (Path): Grobid XML file
+    mode (str): "stream" for the bounded memory evaluator, "full" for evaluate_bibliography
+    max_in_flight (int): Reference cap of the bounded memory evaluator
+Returns:
+    dict: Number of references, seconds and peak RSS
+"""
+def memory_run(path, mode, max_in_flight):
+    with open(CONFIG_PATH) as c:
+        config = json.load(c)
+    output = str(Path(tempfile.gettempdir()).joinpath("benchmark-%s" % os.getpid()))
+    start = time.perf_counter()
+    if mode == "stream":
+        count = evaluation.evaluate_bibliography_stream(path, config, None, output, max_in_flight,
+                                                        searcher=stub_transport(evaluation.stream_searcher(None)))
+    else:
+        from bs4 import BeautifulSoup
+        with open(path) as xml:
+            soup = BeautifulSoup(xml, "lxml-xml")
+        searcher = stub_transport(crossref.CrossrefSearcher(None, 20)) # Process wide cache, as evaluate_bibliography uses
+        count = len(evaluation.evaluate_bibliography(soup, config, None, output, searcher=searcher))
+    seconds = time.perf_counter() - start
+    os.remove(evaluation.results_file_name(output) + ".json")
+    return {"mode": mode, "references": count, "seconds": round(seconds, 2), "peak-rss-mib": round(peak_rss(), 1)}
+
+"""
+Compares peak memory across bibliography sizes, each run in a fresh process so peaks do not carry over
+Parameters:
+    sizes (list[int]): Numbers of references
+    modes (list[str]): Evaluators to compare, "stream" and/or "full"
+    max_in_flight (int): Reference cap of the bounded memory evaluator
+Returns:
+    list[dict]: Result of each run
+"""
+def memory_benchmark(sizes, modes, max_in_flight):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = Path(tmp).joinpath("synthetic-%d.grobid.tei.xml" % size)
+            synthetic_tei(path, size)
+            for mode in modes:
+                child = subprocess.run([sys.executable, __file__, "memory-run", str(path), mode, str(max_in_flight)],
+                                       capture_output=True, text=True, check=True)
+                result = json.loads(child.stdout.strip().splitlines()[-1])
+                print("%(mode)-6s %(references)7d refs %(seconds)8.2f s %(peak-rss-mib)8.1f MiB peak RSS" % result)
+                results.append(result)
+    return results
+
+"""
+Checks that the bounded memory evaluator's peak RSS stays flat as bibliographies grow
+Parameters:
+    results (list[dict]): Results of memory_benchmark
+    slack (float): Largest growth in MiB from the smallest to the largest bibliography counted as flat
+Returns:
+    bool: True if flat, or if fewer than two sizes were run in stream mode
+"""
+def flat_peak(results, slack=FLAT_PEAK_MIB):
+    runs = sorted((r for r in results if r["mode"] == "stream"), key=lambda r: r["references"])
+    if len(runs) < 2:
+        return True
+    growth = runs[-1]["peak-rss-mib"] - runs[0]["peak-rss-mib"]
+    print("stream peak RSS grew %.1f MiB from %d to %d refs (flat within %.1f MiB)" %
+          (growth, runs[0]["references"], runs[-1]["references"], slack))
+    return growth <= slack
+
+
+"""
+Builds labelled title pairs: matching pairs with the variations Grobid and Crossref commonly disagree on,
+and non-matching pairs of unrelated titles
+Parameters:
+    count (int): Number of pairs of each kind
+    seed (int): Random seed
+Returns:
+    list[tuple[str, str, bool]]: Source title, external title and whether they match
+"""
+def title_pairs(count, seed=1):
+    rng = random.Random(seed)
+    phrase = lambda: " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 6)))
+    variations = (
+        lambda main, sub: ("%s: %s" % (sub, main)).capitalize(), # Subtitle moved to the front
+        lambda main, sub: ("%s - %s" % (main, sub)).upper(), # Case and punctuation
+        lambda main, sub: main.capitalize(), # Subtitle dropped
+        lambda main, sub: ("%s: %s" % (main, sub)).replace("e", "", 1).capitalize(), # Typo
+    )
+    pairs = []
+    for _ in range(count):
+        main, sub = phrase(), phrase()
+        title = ("%s: %s" % (main, sub)).capitalize()
+        pairs.append((title, rng.choice(variations)(main, sub), True))
+        pairs.append((title, ("%s: %s" % (phrase(), phrase())).capitalize(), False))
+    return pairs
+
+"""
+Compares the cost and accuracy of the title evaluators in the evaluator registry
+Parameters:
+    count (int): Number of pairs of each kind
+    threshold (float): Score at which a pair is classed as a match
+Returns:
+    list[dict]: Cost and accuracy of each evaluator
+"""
+def title_benchmark(count, threshold):
+    pairs = title_pairs(count)
+    results = []
+    for method, evaluator in evaluation.evaluator_registry["title"].items():
+        evaluation.clear_normalisation_caches() # Each evaluator pays for normalisation, whatever the order
+        start = time.perf_counter()
+        scores = [evaluator.evaluation(src, ext) for src, ext, _ in pairs]
+        seconds = time.perf_counter() - start
+        correct = sum((score >= threshold) == match for score, (_, _, match) in zip(scores, pairs))
+        result = {"method": method, "microseconds-per-pair": round(seconds / len(pairs) * 1e6, 2),
+                  "accuracy": round(correct / len(pairs), 4)}
+        print("%(method)-14s %(microseconds-per-pair)8.2f us/pair  accuracy %(accuracy).4f" % result)
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(description="Offline benchmarks")
+    commands = args.add_subparsers(dest="command", required=True)
+    memory = commands.add_parser("memory", help="peak memory of bounded and full evaluation across bibliography sizes")
+    memory.add_argument("--sizes", type=int, nargs="+", default=[5000, 50000])
+    memory.add_argument("--modes", nargs="+", default=["stream"], choices=["stream", "full"])
+    memory.add_argument("--max-in-flight", type=int, default=100)
+    title = commands.add_parser("title", help="cost and accuracy of the title evaluators")
+    title.add_argument("--pairs", type=int, default=20000, help="number of matching and of non-matching pairs")
+    title.add_argument("--threshold", type=float, default=0.8)
+    run = commands.add_parser("memory-run", help="single measured run, used by the memory benchmark")
+    run.add_argument("path")
+    run.add_argument("mode", choices=["stream", "full"])
+    run.add_argument("max_in_flight", type=int)
+    options = args.parse_args()
+
+    if options.command == "memory":
+        if not flat_peak(memory_benchmark(options.sizes, options.modes, options.max_in_flight)):
+            sys.exit("bounded memory evaluator's peak RSS grows with the bibliography")
+    elif options.command == "title":
+        title_benchmark(options.pairs, options.threshold)
+    elif options.command == "memory-run":
+        with open(os.devnull, "w") as quiet: # Keeps progress messages out of the reported result
+            stdout, sys.stdout = sys.stdout, quiet
+            result = memory_run(options.path, options.mode, options.max_in_flight)
+            sys.stdout = stdout
+        print(json.dumps(result))
@@ -0,0 +1,187 @@
+"""
+Caches for search results
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+MISSING = object() # Returned by get when a key is not cached
+
+"""
+Thread safe in-memory cache where each entry expires after its own time to live
+Attributes:
+    max_entries(int):
+        Number of entries kept before the oldest are evicted
+Methods:
+    get(key):
+        Returns a cached value, MISSING if absent or expired
+    set(key, value, ttl):
+        Caches a value for ttl seconds
+    stats:
+        Returns hit and miss counts
+"""
+class TTLCache:
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.entries = {} # Key to (expiry time, value), in insertion order
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    """
+    Returns a cached value, MISSING if absent or expired
+    Parameters:
+        key (tuple): Cache key
+    Returns:
+        Cached value or MISSING
+    """
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+            return entry[1]
+
+    """
+    Caches a value for ttl seconds
+    Parameters:
+        key (tuple): Cache key
+        value: Value to cache, None is cached as a negative result
+        ttl (float): Seconds before the entry expires
+    Returns: None
+    """
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries.pop(key, None) # Re-inserts so the entry moves to the end of the eviction order
+            self.entries[key] = (time.monotonic() + ttl, value)
+            while len(self.entries) > self.max_entries:
+                del self.entries[next(iter(self.entries))] # Evicts the oldest entry
+
+    """
+    Returns hit and miss counts
+    Parameters: None
+    Returns:
+        dict: hits, misses, hit rate and number of entries
+    """
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit-rate": self.hits / lookups if lookups else 0.0, "entries": len(self.entries)}
+
+
+"""
+Cache stored in a SQLite database in WAL mode, shared by every process on a host that opens the same file
+Readers never block on a writer, so several workers can look up and add entries concurrently.
+Keys and values are stored as JSON and entries expire after their own time to live.
+Attributes:
+    path(str):
+        Location of the database file, created if missing
+    timeout(float):
+        Seconds to wait for another process's write lock before failing
+Methods:
+    get(key):
+        Returns a cached value, MISSING if absent or expired
+    set(key, value, ttl):
+        Caches a value for ttl seconds
+    purge:
+        Deletes expired entries
+    stats:
+        Returns hit and miss counts of this process
+"""
+class SqliteCache:
+    def __init__(self, path, timeout=30):
+        self.path = str(path)
+        self.timeout = timeout
+        self.local = threading.local() # One connection per thread, sqlite3 connections are not shared between threads
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self.connection() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, expires REAL NOT NULL, value TEXT NOT NULL)")
+        self.purge()
+
+    """
+    Returns the calling thread's database connection, opening it on first use
+    Parameters: None
+    Returns:
+        sqlite3.Connection: Connection to the cache database
+    """
+    def connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL") # Safe in WAL mode, a crash can only lose the latest entries
+            self.local.db = db
+        return db
+
+    """
+    Encodes a key so that equal keys always give the same string
+    Parameters:
+        key (tuple): Cache key
+    Returns:
+        str: JSON encoded key
+    """
+    def encode_key(self, key):
+        return json.dumps(key, separators=(",", ":"), ensure_ascii=False)
+
+    """
+    Returns a cached value, MISSING if absent or expired
+    Parameters:
+        key (tuple): Cache key
+    Returns:
+        Cached value or MISSING
+    """
+    def get(self, key):
+        row = self.connection().execute("SELECT value FROM entries WHERE key = ? AND expires >= ?",
+                                        (self.encode_key(key), time.time())).fetchone()
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+        return json.loads(row[0])
+
+    """
+    Caches a value for ttl seconds
+    Parameters:
+        key (tuple): Cache key
+        value: JSON serialisable value to cache, None is cached as a negative result
+        ttl (float): Seconds before the entry expires
+    Returns: None
+    """
+    def set(self, key, value, ttl):
+        with self.connection() as db: # Commits on exit
+            db.execute("INSERT OR REPLACE INTO entries (key, expires, value) VALUES (?, ?, ?)",
+                       (self.encode_key(key), time.time() + ttl, json.dumps(value, ensure_ascii=False)))
+
+    """
+    Deletes expired entries
+    Parameters: None
+    Returns:
+        int: Number of entries deleted
+    """
+    def purge(self):
+        with self.connection() as db:
+            return db.execute("DELETE FROM entries WHERE expires < ?", (time.time(),)).rowcount
+
+    """
+    Returns hit and miss counts of this process
+    Parameters: None
+    Returns:
+        dict: hits, misses, hit rate and number of entries shared by all processes
+    """
+    def stats(self):
+        entries = self.connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit-rate": self.hits / lookups if lookups else 0.0, "entries": entries}
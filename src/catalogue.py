@@ -0,0 +1,161 @@
+"""
+Local reference catalogue
+Generates candidate matches for a reference from a local collection of references
+"""
+
+import hashlib
+import random
+
+import utils
+
+MERSENNE_PRIME = (1 << 61) - 1 # Modulus for the MinHash permutation functions
+HASH_MASK = (1 << 61) - 1
+
+"""
+Hashes an n-gram to an integer that is the same in every process, unlike the built-in hash of a str,
+so signatures and band keys built by one worker are valid in another
+Parameters:
+    gram (str): Character n-gram
+Returns:
+    int: 61-bit hash value
+"""
+def gram_hash(gram):
+    return int.from_bytes(hashlib.blake2b(gram.encode("utf8"), digest_size=8).digest(), "big") & HASH_MASK
+
+"""
+Index of references for matching citations against a local collection
+Titles are normalised, split into character n-grams and summarised as MinHash signatures.
+Signatures are split into bands and each band is hashed into a bucket (locality-sensitive hashing),
+so only references sharing at least one bucket with the query title are considered as candidates.
+Attributes:
+    ngram(int):
+        Length of the character n-grams taken from normalised titles
+    num_perm(int):
+        Number of MinHash permutations in a signature
+    bands(int):
+        Number of LSH bands, must divide num_perm
+    seed(int):
+        Seed for generating the permutation functions
+Methods:
+    shingles(title):
+        Splits a normalised title into character n-grams
+    signature(title):
+        Computes the MinHash signature of a title
+    add(ref):
+        Adds a reference to the index
+    candidates(ref, limit):
+        Returns the references most likely to share a title with ref
+    match(ref, evaluator, limit):
+        Evaluates the shortlisted candidates against ref
+"""
+class ReferenceIndex:
+    def __init__(self, references=None, ngram=3, num_perm=32, bands=16, seed=1):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be divisible by bands")
+        self.ngram = ngram
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_perm)]
+        self.references = []
+        self.signatures = []
+        self.buckets = [{} for _ in range(bands)] # One bucket table per band
+        for ref in references or []:
+            self.add(ref)
+
+    def __len__(self):
+        return len(self.references)
+
+    """
+    Splits a normalised title into character n-grams
+    Parameters:
+        title (str): Reference title
+    Returns:
+        set[str]: Character n-grams of the title
+    """
+    def shingles(self, title):
+        if title is None:
+            return set()
+        text = utils.normalise_str(title)
+        if len(text) <= self.ngram:
+            return {text} if text else set()
+        return {text[i:i + self.ngram] for i in range(len(text) - self.ngram + 1)}
+
+    """
+    Computes the MinHash signature of a title
+    Parameters:
+        title (str): Reference title
+    Returns:
+        tuple[int]: Minimum hash value for each permutation, None if the title is empty
+    """
+    def signature(self, title):
+        hashes = [gram_hash(gram) for gram in self.shingles(title)]
+        if not hashes:
+            return None
+        return tuple(min([(a * h + b) % MERSENNE_PRIME for h in hashes]) for a, b in self.permutations)
+
+    """
+    Splits a signature into its band keys
+    Parameters:
+        signature (tuple[int]): MinHash signature
+    Returns:
+        list[tuple[int]]: One key per band
+    """
+    def band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows] for i in range(self.bands)]
+
+    """
+    Adds a reference to the index
+    References without a title cannot be matched and are ignored
+    Parameters:
+        ref (Reference): Reference to add
+    Returns:
+        bool: True if the reference was indexed
+    """
+    def add(self, ref):
+        signature = self.signature(ref.title)
+        if signature is None:
+            return False
+        ref_id = len(self.references)
+        self.references.append(ref)
+        self.signatures.append(signature)
+        for band, key in zip(self.buckets, self.band_keys(signature)):
+            band.setdefault(key, []).append(ref_id)
+        return True
+
+    """
+    Returns the references most likely to share a title with ref
+    Parameters:
+        ref (Reference): Reference to find candidates for
+        limit (int): Maximum number of candidates returned
+    Returns:
+        list[Reference]: Candidates ordered by estimated title similarity
+    """
+    def candidates(self, ref, limit=10):
+        signature = self.signature(ref.title)
+        if signature is None:
+            return []
+        ids = set()
+        for band, key in zip(self.buckets, self.band_keys(signature)):
+            ids.update(band.get(key, ()))
+        similarity = {} # Estimated Jaccard similarity from the fraction of matching signature values
+        for ref_id in ids:
+            similarity[ref_id] = sum(a == b for a, b in zip(signature, self.signatures[ref_id])) / self.num_perm
+        ranked = sorted(ids, key=lambda ref_id: similarity[ref_id], reverse=True)
+        return [self.references[ref_id] for ref_id in ranked[:limit]]
+
+    """
+    Evaluates the shortlisted candidates against ref
+    Parameters:
+        ref (Reference): Source reference
+        evaluator (EvaluationController): Controller loaded with evaluation settings
+        limit (int): Maximum number of candidates evaluated
+    Returns:
+        list[dict]: Source reference, candidate and evaluation for each candidate
+    """
+    def match(self, ref, evaluator, limit=10):
+        results = []
+        for candidate in self.candidates(ref, limit):
+            results.append({'reference': ref, 'reference-located': candidate, 'evaluation': evaluator.evaluate(ref, candidate)})
+        return results
@@ -0,0 +1,397 @@
+"""
+Command line batch runner
+Evaluates directories or globs of PDF and Grobid XML files through bounded work queues,
+with separate worker pools for Grobid conversion, Crossref lookup and scoring.
+
+Usage:
+    python src/cli.py papers/ "archive/**/*.pdf" --config example-config.json --output results/
+"""
+
+import argparse
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+import crossref
+import evaluation
+import parser
+import utils
+from cache import SqliteCache
+
+TEI_SUFFIX = ".grobid.tei.xml"
+DONE = object() # Queue sentinel telling a worker to stop
+
+"""
+Finds the PDF and Grobid XML files matching a list of paths, directories and glob patterns
+When both a PDF and its Grobid XML are found only the XML is kept, skipping the Grobid conversion
+Parameters:
+    patterns (list[str]): Files, directories or glob patterns
+Returns:
+    list[Path]: Input files, one per document
+"""
+def collect_inputs(patterns):
+    found = []
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            found.extend(p for p in path.rglob("*") if p.is_file())
+        else:
+            found.extend(Path(p) for p in glob.glob(pattern, recursive=True))
+
+    documents = {}
+    for path in found:
+        if path.name.endswith(TEI_SUFFIX):
+            documents[document_name(path)] = path # XML replaces a PDF of the same document
+        elif path.suffix.lower() == ".pdf":
+            documents.setdefault(document_name(path), path)
+    return sorted(documents.values())
+
+"""
+Returns a document's path without its file extension, used to name its outputs
+Parameters:
+    path (Path): PDF or Grobid XML file
+Returns:
+    Path: Document path without extension
+"""
+def document_name(path):
+    if path.name.endswith(TEI_SUFFIX):
+        return path.with_name(path.name[:-len(TEI_SUFFIX)])
+    return path.with_suffix("")
+
+"""
+Returns the deepest directory containing every input, outputs keep their path relative to it
+Parameters:
+    paths (list[Path]): Input files
+Returns:
+    Path: Common directory of the inputs
+"""
+def input_root(paths):
+    if not paths:
+        return Path.cwd()
+    return Path(os.path.commonpath([p.resolve().parent for p in paths]))
+
+"""
+A document being evaluated
+Attributes:
+    path (Path): PDF or Grobid XML file
+    results (list[dict]): Evaluation of each reference, filled in by the scoring workers
+    remaining (int): Number of references still to be scored
+Methods:
+    complete(index, result):
+        Stores a reference result and returns True when the document is finished
+"""
+class Document:
+    def __init__(self, path):
+        self.path = path
+        self.results = []
+        self.remaining = 0
+        self.lock = threading.Lock()
+
+    """
+    Stores a reference result and returns True when the document is finished
+    Parameters:
+        index (int): Position of the reference in the bibliography
+        result (dict): Evaluation result
+    Returns:
+        bool: True if this was the last reference
+    """
+    def complete(self, index, result):
+        with self.lock:
+            self.results[index] = result
+            self.remaining -= 1
+            return self.remaining == 0
+
+"""
+Thread safe progress and throughput reporting
+Attributes:
+    total (int): Number of documents
+Methods:
+    add(counter, n):
+        Increments a counter and refreshes the progress bar
+    summary:
+        Returns the final counts and rates
+"""
+class Progress:
+    def __init__(self, total):
+        from tqdm import tqdm # Imported on first use to keep start up fast
+        self.bar = tqdm(total=total, unit="doc")
+        self.counts = {"documents": 0, "failed": 0, "references": 0, "lookups": 0, "errors": 0}
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    """
+    Increments a counter and refreshes the progress bar
+    Parameters:
+        counter (str): Name of the counter
+        n (int): Amount to add
+    Returns: None
+    """
+    def add(self, counter, n=1):
+        with self.lock:
+            self.counts[counter] += n
+            if counter in ("documents", "failed"):
+                self.bar.update(n)
+            elapsed = max(time.perf_counter() - self.start, 1e-9)
+            self.bar.set_postfix({"refs/s": "%.1f" % (self.counts["references"] / elapsed),
+                                  "lookups/s": "%.1f" % (self.counts["lookups"] / elapsed)}, refresh=False)
+
+    """
+    Returns the final counts and rates
+    Parameters: None
+    Returns:
+        dict: Counters, elapsed seconds and rates
+    """
+    def summary(self):
+        self.bar.close()
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return dict(self.counts, seconds=round(elapsed, 2),
+                    refs_per_second=round(self.counts["references"] / elapsed, 2),
+                    lookups_per_second=round(self.counts["lookups"] / elapsed, 2))
+
+"""
+Evaluates many documents through a pipeline of bounded queues
+Documents flow through three worker pools: Grobid conversion and parsing, Crossref lookup and scoring.
+Full queues block the previous stage, so at most queue_size items wait between stages.
+Attributes:
+    config (dict): Evaluation configuration
+    mailto (str): Email address required for crossref api
+    output_dir (Path): Directory for per-document results, mirroring the inputs' directories, next to each input when None (optional)
+    grobid_config (str): Location of Grobid config file, required for PDF inputs (optional)
+    grobid_workers (int): Number of concurrent Grobid conversions
+    lookup_workers (int): Number of concurrent Crossref lookups
+    scoring_workers (int): Number of scoring workers
+    queue_size (int): Capacity of each queue between stages
+    searcher (CrossrefSearcher): Searcher shared by the lookup workers (optional)
+    keep_xml (bool): Writes the Grobid XML of PDF inputs next to their results (optional)
+Methods:
+    run(paths):
+        Evaluates all documents and returns a run summary
+"""
+class BatchRunner:
+    def __init__(self, config, mailto, output_dir=None, grobid_config=None, grobid_workers=1,
+                 lookup_workers=4, scoring_workers=1, queue_size=64, searcher=None, keep_xml=False):
+        self.evaluator = evaluation.EvaluationController(config)
+        self.output_dir = Path(output_dir) if output_dir is not None else None
+        self.grobid_config = grobid_config
+        self.grobid_workers = grobid_workers
+        self.lookup_workers = lookup_workers
+        self.scoring_workers = scoring_workers
+        self.queue_size = queue_size
+        self.searcher = searcher if searcher is not None else crossref.CrossrefSearcher(mailto, 20)
+        self.keep_xml = keep_xml
+        self.root = None # Common directory of the inputs, set by run
+        self.client = None
+        self.client_lock = threading.Lock()
+
+    """
+    Returns the HTTP client shared by the conversion workers, creating it on first use
+    Parameters: None
+    Returns:
+        httpx.Client: Client keeping connections to the Grobid server open between documents
+    """
+    def grobid_client(self):
+        if self.grobid_config is None:
+            raise ValueError("a Grobid config is required for PDF inputs")
+        with self.client_lock:
+            if self.client is None:
+                import httpx # Imported on first use to keep start up fast
+                self.client = httpx.Client()
+        return self.client
+
+    """
+    Returns where a document's outputs are written, keeping its path relative to the inputs' common directory
+    so documents with the same file name in different directories do not overwrite each other
+    Parameters:
+        path (Path): PDF or Grobid XML file
+    Returns:
+        Path: Input path, or its place under the output directory
+    """
+    def output_path(self, path):
+        if self.output_dir is None:
+            return path
+        output = self.output_dir / path.resolve().relative_to(self.root)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        return output
+
+    """
+    Parses a document's references, PDFs are streamed through Grobid without an intermediate file
+    Parameters:
+        doc (Document): Document to parse
+    Returns:
+        list[Reference]: Parsed references
+    """
+    def parse_document(self, doc):
+        path = doc.path
+        if not path.name.endswith(TEI_SUFFIX):
+            pdf = parser.PdfToXML(path, self.output_path(path), self.grobid_config)
+            return list(pdf.stream(fields=self.evaluator.fields(), keep_xml=self.keep_xml, http=self.grobid_client()))
+        with open(path) as xml:
+            soup = BeautifulSoup(xml, "lxml-xml")
+        return parser.XmlBibliography(self.evaluator.fields()).parse(soup)
+
+    """
+    Writes the results of a finished document
+    Parameters:
+        doc (Document): Finished document
+    Returns: None
+    """
+    def export(self, doc):
+        try:
+            name = document_name(self.output_path(doc.path))
+            utils.export_json(doc.results, str(name.parent / evaluation.results_file_name(name.name)))
+        except Exception as e: # A failed export must not stop the worker
+            print("failed", doc.path, e)
+            self.progress.add("failed")
+            return
+        self.progress.add("documents")
+
+    """
+    Grobid stage worker, turns documents into queued references
+    Parameters:
+        documents (Queue): Documents to parse
+        lookups (Queue): Queue of (document, index, reference) for the lookup stage
+    Returns: None
+    """
+    def grobid_worker(self, documents, lookups):
+        while (doc := documents.get()) is not DONE:
+            try:
+                refs = self.parse_document(doc)
+            except Exception as e: # A failed document must not stop the batch
+                print("failed", doc.path, e)
+                self.progress.add("failed")
+                continue
+            doc.results = [None] * len(refs)
+            doc.remaining = len(refs)
+            if not refs:
+                self.export(doc)
+            for index, ref in enumerate(refs):
+                lookups.put((doc, index, ref)) # Blocks while the lookup stage is behind
+
+    """
+    Lookup stage worker, searches Crossref for queued references
+    Parameters:
+        lookups (Queue): Queue of (document, index, reference)
+        scores (Queue): Queue of (document, index, reference, search results or lookup error) for the scoring stage
+    Returns: None
+    """
+    def lookup_worker(self, lookups, scores):
+        while (item := lookups.get()) is not DONE:
+            doc, index, ref = item
+            try:
+                search_results = self.searcher.search(ref)
+            except Exception as e: # Passed on so the reference is still completed and the pipeline keeps draining
+                search_results = e
+            self.progress.add("lookups")
+            scores.put((doc, index, ref, search_results))
+
+    """
+    Scoring stage worker, evaluates located references and exports finished documents
+    Parameters:
+        scores (Queue): Queue of (document, index, reference, search results or lookup error)
+    Returns: None
+    """
+    def scoring_worker(self, scores):
+        while (item := scores.get()) is not DONE:
+            doc, index, ref, search_results = item
+            try:
+                if isinstance(search_results, Exception):
+                    raise search_results
+                result = evaluation.evaluate_result(self.evaluator, ref, search_results)
+            except Exception as e: # A failed reference is recorded, the rest of its document is still evaluated
+                print("failed", doc.path, repr(ref), e)
+                result = {'reference': ref, 'reference-located': 'Error', 'evaluation': 'None', 'error': str(e)}
+                self.progress.add("errors")
+            self.progress.add("references")
+            if doc.complete(index, result): # Always reached, otherwise the document is never exported
+                self.export(doc)
+
+    """
+    Starts a pool of worker threads
+    Parameters:
+        count (int): Number of threads
+        target (callable): Worker function
+        args (tuple): Worker arguments
+    Returns:
+        list[Thread]: Started threads
+    """
+    def start(self, count, target, *args):
+        threads = [threading.Thread(target=target, args=args, daemon=True) for _ in range(max(count, 1))]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    """
+    Stops a pool by sending one sentinel per thread and waiting for them to finish
+    Parameters:
+        threads (list[Thread]): Worker threads
+        work (Queue): Queue the threads consume
+    Returns: None
+    """
+    def stop(self, threads, work):
+        for _ in threads:
+            work.put(DONE)
+        for thread in threads:
+            thread.join()
+
+    """
+    Evaluates all documents and returns a run summary
+    Parameters:
+        paths (list[Path]): PDF or Grobid XML files
+    Returns:
+        dict: Counters, elapsed seconds and rates
+    """
+    def run(self, paths):
+        if self.output_dir is not None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            self.root = input_root(paths)
+        self.progress = Progress(len(paths))
+        documents = queue.Queue(self.queue_size)
+        lookups = queue.Queue(self.queue_size)
+        scores = queue.Queue(self.queue_size)
+
+        grobid = self.start(self.grobid_workers, self.grobid_worker, documents, lookups)
+        lookup = self.start(self.lookup_workers, self.lookup_worker, lookups, scores)
+        scoring = self.start(self.scoring_workers, self.scoring_worker, scores)
+
+        for path in paths:
+            documents.put(Document(path))
+        self.stop(grobid, documents) # Each stage is drained before the next one is stopped
+        self.stop(lookup, lookups)
+        self.stop(scoring, scores)
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        return self.progress.summary()
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(description="Evaluates the references of many PDF or Grobid XML files")
+    args.add_argument("inputs", nargs="+", help="files, directories or glob patterns")
+    args.add_argument("--config", required=True, help="evaluation configuration")
+    args.add_argument("--mailto", default=os.getenv("MAILTO"), help="email address required for crossref api")
+    args.add_argument("--grobid-config", default=None, help="Grobid config file, required for PDF inputs")
+    args.add_argument("--output", default=None, help="directory for results, mirroring the input directories, next to each input by default")
+    args.add_argument("--grobid-workers", type=int, default=1)
+    args.add_argument("--lookup-workers", type=int, default=4)
+    args.add_argument("--scoring-workers", type=int, default=1)
+    args.add_argument("--queue-size", type=int, default=64, help="capacity of each queue between stages")
+    args.add_argument("--keep-xml", action="store_true", help="also write the Grobid XML of PDF inputs")
+    args.add_argument("--cache", default=None, help="SQLite search cache, kept between runs and shared with workers")
+    options = args.parse_args()
+
+    with open(options.config) as c:
+        config = json.load(c)
+    inputs = collect_inputs(options.inputs)
+    print(len(inputs), "documents found")
+    searcher = crossref.CrossrefSearcher(options.mailto, 20, SqliteCache(options.cache)) if options.cache else None
+    runner = BatchRunner(config, options.mailto, options.output, options.grobid_config, options.grobid_workers,
+                         options.lookup_workers, options.scoring_workers, options.queue_size, searcher, options.keep_xml)
+    summary = runner.run(inputs)
+    summary["cache"] = runner.searcher.cache.stats()
+    print(json.dumps(summary, indent=4))
@@ -0,0 +1,209 @@
+"""
+Long-running evaluation worker
+Keeps clients and configurations loaded between jobs so each document only pays its own processing cost.
+Jobs are sent over a local socket as one JSON object per line and answered with one JSON object per line.
+
+Job format:
+    path (str): Path of a Grobid TEI XML file or a PDF file
+    config (str): Path of an evaluation configuration, defaults to the worker's configuration (optional)
+    file_name (str): Name of an output file, results are only exported when given (optional)
+    keep_xml (bool): Also writes the Grobid XML of a PDF next to it, defaults to the worker's setting (optional)
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+import crossref
+import evaluation
+import utils
+from cache import SqliteCache
+from parser import PdfToXML
+
+"""
+Evaluates jobs using clients and configurations kept between jobs
+Attributes:
+    config_path (str): Location of the default evaluation configuration
+    mailto (str): Email address required for crossref api
+    grobid_config (str): Location of Grobid config file, required for PDF jobs (optional)
+    timeout (int): Crossref timeout in seconds
+    cache (SqliteCache): Search cache, shared with other workers on the host when they open the same file (optional)
+    keep_xml (bool): Writes the Grobid XML of PDF jobs next to the PDF, jobs can override it (optional)
+Methods:
+    load_config(path):
+        Returns a configuration, reading it from disk only when it has changed
+    grobid_client:
+        Returns the HTTP client for the Grobid server, creating it on first use
+    parse_pdf(path, fields, keep_xml):
+        Streams a PDF through Grobid and returns its parsed references
+    run_job(job):
+        Evaluates a single job
+"""
+class EvaluationWorker:
+    def __init__(self, config_path, mailto, grobid_config=None, timeout=20, cache=None, keep_xml=False):
+        self.config_path = Path(config_path)
+        self.mailto = mailto
+        self.grobid_config = grobid_config
+        self.keep_xml = keep_xml
+        self.searcher = crossref.CrossrefSearcher(mailto, timeout, cache) # Shared by all jobs
+        self.configs = {} # Config path to (modified time, config) pairs
+        self.client = None
+        self.lock = threading.Lock()
+        self.load_config(self.config_path) # Fails at start up rather than on the first job
+
+    """
+    Returns a configuration, reading it from disk only when it has changed
+    Parameters:
+        path (Path): Location of the configuration file
+    Returns:
+        dict: Evaluation configuration
+    """
+    def load_config(self, path):
+        path = Path(path).resolve()
+        mtime = path.stat().st_mtime
+        with self.lock:
+            cached = self.configs.get(path)
+            if cached is None or cached[0] != mtime:
+                with open(path) as c:
+                    cached = (mtime, json.load(c))
+                self.configs[path] = cached
+        return cached[1]
+
+    """
+    Returns the HTTP client for the Grobid server, creating it on first use
+    Parameters: None
+    Returns:
+        httpx.Client: Client keeping connections to the Grobid server open between jobs
+    """
+    def grobid_client(self):
+        if self.grobid_config is None:
+            raise ValueError("a Grobid config is required for PDF jobs")
+        with self.lock:
+            if self.client is None:
+                import httpx # Imported on first use to keep start up fast
+                self.client = httpx.Client()
+        return self.client
+
+    """
+    Streams a PDF through Grobid and returns its parsed references, without an intermediate XML file
+    Parameters:
+        path (Path): Location of the PDF file
+        fields (set[str]): Reference fields to extract
+        keep_xml (bool): Also writes the Grobid XML next to the PDF
+    Returns:
+        list[Reference]: Parsed references
+    Raises:
+        RuntimeError: If Grobid fails or stays busy
+    """
+    def parse_pdf(self, path, fields, keep_xml):
+        pdf = PdfToXML(path, path, self.grobid_config)
+        return list(pdf.stream(fields=fields, keep_xml=keep_xml, http=self.grobid_client()))
+
+    """
+    Evaluates a single job
+    Parameters:
+        job (dict): Job as described in the module documentation
+    Returns:
+        list[dict]: all reference evaluations
+    """
+    def run_job(self, job):
+        path = Path(job["path"])
+        config = self.load_config(job.get("config", self.config_path))
+        file_name = job.get("file_name")
+        if path.suffix.lower() == ".pdf":
+            evaluator = evaluation.EvaluationController(config)
+            refs = self.parse_pdf(path, evaluator.fields(), job.get("keep_xml", self.keep_xml))
+            return evaluation.evaluate_references(evaluator, refs, self.mailto, file_name or "",
+                                                  searcher=self.searcher, export=file_name is not None)
+        with open(path) as xml:
+            soup = BeautifulSoup(xml, "lxml-xml")
+        return evaluation.evaluate_bibliography(soup, config, self.mailto, file_name or "",
+                                                searcher=self.searcher, export=file_name is not None)
+
+
+"""
+Reads jobs from a connection and writes back their results
+Methods:
+    handle:
+        Answers each job line with a result line
+"""
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                results = self.server.worker.run_job(json.loads(line))
+                response = {"status": "ok", "results": results}
+            except Exception as e: # Reports the failure to the client and keeps the worker running
+                response = {"status": "error", "error": str(e)}
+            self.wfile.write((utils.to_json(response) + "\n").encode())
+            self.wfile.flush()
+
+
+"""
+Threaded TCP server holding the shared worker
+Attributes:
+    worker (EvaluationWorker): Worker shared by all connections
+"""
+class WorkerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, worker):
+        super().__init__(address, JobHandler)
+        self.worker = worker
+
+
+"""
+Starts the worker and serves jobs until interrupted
+Parameters:
+    worker (EvaluationWorker): Worker used to evaluate jobs
+    host (str): Address to listen on, local only by default
+    port (int): Port to listen on
+Returns: None
+"""
+def serve(worker, host="127.0.0.1", port=8765):
+    with WorkerServer((host, port), worker) as server:
+        print("worker listening on %s:%d" % (host, port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("worker stopped")
+
+
+"""
+Sends a job to a running worker and waits for its results
+Parameters:
+    job (dict): Job as described in the module documentation
+    host (str): Worker address
+    port (int): Worker port
+Returns:
+    dict: Response with a status and either results or an error
+"""
+def submit(job, host="127.0.0.1", port=8765):
+    with socket.create_connection((host, port)) as conn:
+        conn.sendall((json.dumps(job) + "\n").encode())
+        with conn.makefile("rb") as response:
+            return json.loads(response.readline())
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(description="Runs a long-running reference evaluation worker")
+    args.add_argument("--config", default="example-config.json", help="default evaluation configuration")
+    args.add_argument("--grobid-config", default=None, help="Grobid config file, required for PDF jobs")
+    args.add_argument("--mailto", default=os.getenv("MAILTO"), help="email address required for crossref api")
+    args.add_argument("--host", default="127.0.0.1")
+    args.add_argument("--port", type=int, default=8765)
+    args.add_argument("--cache", default=None, help="SQLite search cache, shared by workers given the same file")
+    args.add_argument("--keep-xml", action="store_true", help="also write the Grobid XML of PDF jobs next to the PDF")
+    options = args.parse_args()
+    cache = SqliteCache(options.cache) if options.cache else None
+    worker = EvaluationWorker(options.config, options.mailto, options.grobid_config, cache=cache, keep_xml=options.keep_xml)
+    serve(worker, options.host, options.port)
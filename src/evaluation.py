@@ -3,12 +3,17 @@ For comparing references and analysing the validity of their components
 """
 
 import abc
+import asyncio
+import queue
+import threading
 from abc import abstractmethod
 from statistics import fmean
 
 import utils
 import parser
 import crossref
+import journals
+from cache import TTLCache
 
 import rapidfuzz
 
@@ -109,6 +114,8 @@ class BooleanAuthorEvaluator(BooleanEvaluator):
         float: Numerical representation of boolean true (1.0)/false (0.0)
     """
     def evaluation(self, src_auth, ext_auth):
+        if src_auth is None or ext_auth is None: # e.g. a catalogue record without authors
+            return "N/A"
         if len(src_auth) == 0: # if source list is empty
             return 0.0
         for auth in src_auth:
@@ -132,7 +139,7 @@ class BooleanDoiEvaluator(BooleanEvaluator):
         float: Numerical representation of boolean true (1.0)/false (0.0)
     """
     def evaluation(self, src_doi, ext_doi):
-        if src_doi is None:
+        if src_doi is None or ext_doi is None: # e.g. a catalogue record without a DOI
             return "N/A"
         else:
             return float(src_doi.lower() == ext_doi.lower())
@@ -232,6 +239,8 @@ class LevenshteinTitleEvaluator(LevenshteinEvaluator):
         float: Normalised similarity score between 0.0-1.0
     """
     def evaluation(self, src, ext):
+        if src is None or ext is None:
+            return "N/A"
         return rapidfuzz.distance.Levenshtein.normalized_similarity(utils.normalise_str(src), utils.normalise_str(ext))
 
 """
@@ -274,11 +283,181 @@ class LevenshteinVolumeEvaluator(LevenshteinEvaluator):
             return "N/A"
         return rapidfuzz.distance.Levenshtein.normalized_similarity(src.strip(), ext.strip())
 
+"""
+Abstract class for rapidfuzz token set evaluators
+Token set similarity ignores word order and duplicated words, so reordered subtitles still match
+Attributes:
+    score_cutoff(float):
+        Scores below the cutoff are reported as 0.0, letting rapidfuzz stop comparing early
+Methods:
+    name:
+        Returns the name of the evaluator
+"""
+class TokenSetEvaluator(Evaluator):
+    def __init__(self, score_cutoff=0.0):
+        self.score_cutoff = score_cutoff
+
+    """
+    Returns the name of the evaluator
+    Parameters: None
+    Returns:
+        str: Name of the evaluation method (class name)
+    """
+    def name(self):
+        return "token-set"
+
+"""
+Abstract class for rapidfuzz partial ratio evaluators
+Partial ratio scores the best matching substring, so truncated titles or titles with extra subtitles still match
+Attributes:
+    score_cutoff(float):
+        Scores below the cutoff are reported as 0.0, letting rapidfuzz stop comparing early
+Methods:
+    name:
+        Returns the name of the evaluator
+"""
+class PartialRatioEvaluator(Evaluator):
+    def __init__(self, score_cutoff=0.0):
+        self.score_cutoff = score_cutoff
+
+    """
+    Returns the name of the evaluator
+    Parameters: None
+    Returns:
+        str: Name of the evaluation method (class name)
+    """
+    def name(self):
+        return "partial-ratio"
+
+"""
+Reference title attribute evaluation using token set similarity
+Methods:
+    evaluation (src, ext):
+        The evaluation algorithm
+"""
+class TokenSetTitleEvaluator(TokenSetEvaluator):
+    """
+    The evaluation algorithm
+    Parameters:
+        src (str): Source Reference title attribute
+        ext (str): External Reference title attribute
+    Returns:
+        float: Normalised similarity score between 0.0-1.0
+    """
+    def evaluation(self, src, ext):
+        if src is None or ext is None:
+            return "N/A"
+        return rapidfuzz.fuzz.token_set_ratio(utils.normalise_str(src), utils.normalise_str(ext),
+                                              score_cutoff=self.score_cutoff * 100) / 100 # rapidfuzz scores are 0-100
+
+"""
+Reference title attribute evaluation using partial ratio similarity
+Methods:
+    evaluation (src, ext):
+        The evaluation algorithm
+"""
+class PartialRatioTitleEvaluator(PartialRatioEvaluator):
+    """
+    The evaluation algorithm
+    Parameters:
+        src (str): Source Reference title attribute
+        ext (str): External Reference title attribute
+    Returns:
+        float: Normalised similarity score between 0.0-1.0
+    """
+    def evaluation(self, src, ext):
+        if src is None or ext is None:
+            return "N/A"
+        return rapidfuzz.fuzz.partial_ratio(utils.normalise_str(src), utils.normalise_str(ext),
+                                            score_cutoff=self.score_cutoff * 100) / 100
+
+"""
+Reference journal attribute evaluation using token set similarity
+Journal names are compared by their index keys, so stop words such as "of the" do not count
+Methods:
+    evaluation (src, ext):
+        The evaluation algorithm
+"""
+class TokenSetJournalEvaluator(TokenSetEvaluator):
+    """
+    The evaluation algorithm
+    Parameters:
+        src (str): Source Reference journal attribute
+        ext (str): External Reference journal attribute
+    Returns:
+        float: Normalised similarity score between 0.0-1.0
+    """
+    def evaluation(self, src, ext):
+        if src is None or ext is None:
+            return "N/A"
+        return rapidfuzz.fuzz.token_set_ratio(journals.journal_key(src), journals.journal_key(ext),
+                                              score_cutoff=self.score_cutoff * 100) / 100
+
+"""
+Reference journal attribute evaluation using partial ratio similarity
+Journal names are compared by their index keys, so stop words such as "of the" do not count
+Methods:
+    evaluation (src, ext):
+        The evaluation algorithm
+"""
+class PartialRatioJournalEvaluator(PartialRatioEvaluator):
+    """
+    The evaluation algorithm
+    Parameters:
+        src (str): Source Reference journal attribute
+        ext (str): External Reference journal attribute
+    Returns:
+        float: Normalised similarity score between 0.0-1.0
+    """
+    def evaluation(self, src, ext):
+        if src is None or ext is None:
+            return "N/A"
+        return rapidfuzz.fuzz.partial_ratio(journals.journal_key(src), journals.journal_key(ext),
+                                            score_cutoff=self.score_cutoff * 100) / 100
+
+"""
+Abstract class for abbreviation evaluators
+Methods:
+    name:
+        Returns the name of the evaluator
+"""
+class AbbreviationEvaluator(Evaluator):
+    """
+    Returns the name of the evaluator
+    Parameters: None
+    Returns:
+        str: Name of the evaluation method (class name)
+    """
+    def name(self):
+        return "abbreviation"
+
+"""
+Reference journal attribute evaluation against the journal abbreviation index
+Methods:
+    evaluation (src, ext):
+        The evaluation algorithm
+"""
+class AbbreviationJournalEvaluator(AbbreviationEvaluator):
+    """
+    The evaluation algorithm
+    Parameters:
+        src (str): Source Reference journal attribute
+        ext (str): External Reference journal attribute
+    Returns:
+        float: Numerical representation of boolean true (1.0)/false (0.0)
+    """
+    def evaluation(self, src, ext):
+        if src is None or ext is None:
+            return "N/A"
+        return float(journals.journal_index().matches(src, ext)) # Index is loaded once, lookups are dict reads
+
 # Dict of evaluators for each Reference attribute
 evaluator_registry = {
     "title": {
         "boolean": BooleanTitleEvaluator(),
-        "levenshtein": LevenshteinTitleEvaluator()
+        "levenshtein": LevenshteinTitleEvaluator(),
+        "token-set": TokenSetTitleEvaluator(score_cutoff=0.5),
+        "partial-ratio": PartialRatioTitleEvaluator(score_cutoff=0.5)
     },
     "author": {
         "boolean": BooleanAuthorEvaluator()
@@ -296,11 +475,29 @@ evaluator_registry = {
     },
     "pages": {
         "boolean": BooleanPagesEvaluator()
+    },
+    "journal": {
+        "abbreviation": AbbreviationJournalEvaluator(),
+        "token-set": TokenSetJournalEvaluator(score_cutoff=0.5),
+        "partial-ratio": PartialRatioJournalEvaluator(score_cutoff=0.5)
     }
 }
 
+# Policies for fields whose score is missing ("N/A" or None) when computing the overall score
+MISSING_POLICIES = ("ignore", "zero", "fail")
+OVERALL_KEY = "overall" # Config entry holding settings of the overall score rather than of an attribute
+OVERALL_THRESHOLD = 0.5 # Minimum overall score for a reference to pass when the config sets none
+STREAM_CACHE_ENTRIES = 1000 # Search cache size of the bounded memory evaluator, so the cache does not grow with the bibliography
+STREAM_CLEAR_INTERVAL = 1000 # References written by the bounded memory evaluator between clears of the normalisation caches
+
 """
 Manages evaluation inputs and outputs
+Besides "evaluators", each attribute in the config may set:
+    weight (float): Weight of the attribute in the overall score, defaults to 1.0
+    threshold (float): Minimum attribute score for the reference to pass, no minimum by default
+    missing (str): "ignore" leaves a missing score out of the overall score (default),
+        "zero" counts it as 0.0 and "fail" also fails the reference
+The "overall" entry may set threshold, the minimum overall score for a reference to pass (OVERALL_THRESHOLD by default)
 Attributes:
     config(dict):
         JSON formatted dictionary for setting evaluation methods for attributes
@@ -311,10 +508,35 @@ Methods:
         Combines evaluation scores using a weighted average
     evaluate(src_ref, ext_ref):
         Evaluates attributes of a single Reference instance
+    evaluate_batch(pairs):
+        Evaluates attributes of many Reference pairs
+    score_matrix(elements):
+        Arranges attribute scores into a matrix
+    overall_scores(matrix):
+        Computes the overall score and pass state of each row of a score matrix
+    fields:
+        Returns the Reference fields read by an evaluation run
 """
 class EvaluationController:
     def __init__(self, config):
         self.config = config
+        self.elements = [elem for elem in config if elem != OVERALL_KEY] # Column order of score matrices
+        self.overall_threshold = float(config.get(OVERALL_KEY, {}).get("threshold", OVERALL_THRESHOLD))
+        self.weights = [float(config[elem].get("weight", 1.0)) for elem in self.elements]
+        self.thresholds = [config[elem].get("threshold") for elem in self.elements]
+        self.missing = [config[elem].get("missing", "ignore") for elem in self.elements]
+        for policy in self.missing:
+            if policy not in MISSING_POLICIES:
+                raise ValueError("unknown missing policy %s, expected one of %s" % (policy, MISSING_POLICIES))
+
+    """
+    Returns the Reference fields read by an evaluation run
+    Parameters: None
+    Returns:
+        set[str]: Configured fields and the fields needed to search for a reference
+    """
+    def fields(self):
+        return set(self.elements) | set(crossref.SEARCH_FIELDS)
 
     """
     Evaluates element using evaluation method specified in config
@@ -376,13 +598,144 @@ class EvaluationController:
         dict: Nested dictionary of evaluation result strings
     """
     def evaluate(self, src_ref, ext_ref):
-        results = {}
-        for elem in self.config:
-            results[elem] = self.evaluate_element(elem, src_ref, ext_ref)
-        overall = all(results[elem]["score"] for elem in results) # overall combined score of all attribute scores
+        return self.evaluate_batch([(src_ref, ext_ref)])[0]
+
+    """
+    Evaluates attributes of many Reference pairs, computing overall scores for the whole batch at once
+    Parameters:
+        pairs (list[tuple[Reference, Reference]]): Source and external Reference pairs
+    Returns:
+        list[dict]: Nested dictionary of evaluation results for each pair
+    """
+    def evaluate_batch(self, pairs):
+        elements = []
+        for src_ref, ext_ref in pairs:
+            elements.append({elem: self.evaluate_element(elem, src_ref, ext_ref) for elem in self.elements})
+        overall = self.overall_scores(self.score_matrix(elements))
+
+        return [{"overall": score, "passed": passed, "reference element": results} # list of attributes and their evaluations
+                for (score, passed), results in zip(overall, elements)]
+
+    """
+    Arranges attribute scores into a matrix with a row per reference and a column per attribute
+    Parameters:
+        elements (list[dict]): Attribute evaluations of each reference
+    Returns:
+        list[list[float]]: Attribute scores, None where the score is missing
+    """
+    def score_matrix(self, elements):
+        matrix = []
+        for results in elements:
+            row = []
+            for elem in self.elements:
+                score = results[elem]["score"]
+                row.append(float(score) if isinstance(score, (int, float)) else None) # "N/A" and None are missing
+            matrix.append(row)
+        return matrix
+
+    """
+    Computes the overall score and pass state of each row of a score matrix
+    The overall score is the weighted average of the attribute scores, with missing scores handled by each
+    attribute's missing policy. A row passes when every attribute meets its threshold
+    and the overall score meets the overall threshold.
+    Parameters:
+        matrix (list[list[float]]): Attribute scores, None where the score is missing
+    Returns:
+        list[tuple[float, bool]]: Overall score (None if no score counted) and pass state of each row
+    """
+    def overall_scores(self, matrix):
+        totals = [0.0] * len(matrix)
+        weight_sums = [0.0] * len(matrix)
+        passed = [True] * len(matrix)
+
+        for col, (weight, threshold, missing) in enumerate(zip(self.weights, self.thresholds, self.missing)):
+            column = [row[col] for row in matrix] # Works column by column so each attribute's settings are read once
+            for i, score in enumerate(column):
+                if score is None:
+                    if missing == "ignore":
+                        continue
+                    score = 0.0
+                    if missing == "fail":
+                        passed[i] = False
+                if threshold is not None and score < threshold:
+                    passed[i] = False
+                totals[i] += weight * score
+                weight_sums[i] += weight
+
+        overall = [total / weight_sum if weight_sum else None for total, weight_sum in zip(totals, weight_sums)]
+        return [(score, ok and score is not None and score >= self.overall_threshold) # No counted score never passes
+                for score, ok in zip(overall, passed)]
+
+
+"""
+Pairs a source reference with its search results and evaluates them
+Parameters:
+    evaluator (EvaluationController): Controller loaded with evaluation settings
+    ref (Reference): Source reference
+    search_results (dict): Crossref search results, None if nothing was found
+    catalogue (ReferenceIndex): Local collection searched when Crossref finds no match (optional)
+Returns:
+    dict: Source reference, located reference and evaluation
+"""
+def evaluate_result(evaluator, ref, search_results, catalogue=None):
+    if search_results is None and catalogue is not None:
+        matches = catalogue.match(ref, evaluator)
+        if matches:
+            return max(matches, key=lambda res: (res['evaluation']['passed'], res['evaluation']['overall'] or 0.0)) # Prefers a passing candidate
+    if search_results is None:
+        return {'reference': ref, 'reference-located': 'None Found', 'evaluation': 'None'} # If no reference is found
+    found_ref = crossref.CrossrefParser().extract_ref(search_results)
+    evaluation = evaluator.evaluate(ref, found_ref)
+    return {'reference': ref, 'reference-located': found_ref, 'evaluation': evaluation}
 
-        return {"overall": overall, "reference element": results} # list of attributes and their evaluations
+"""
+Pairs source references with their search results and evaluates them as one batch
+Parameters:
+    evaluator (EvaluationController): Controller loaded with evaluation settings
+    refs (list[Reference]): Source references
+    search_results (list[dict]): Crossref search results of each reference, None if nothing was found
+    catalogue (ReferenceIndex): Local collection searched when Crossref finds no match (optional)
+Returns:
+    list[dict]: Source reference, located reference and evaluation of each reference
+"""
+def evaluate_results(evaluator, refs, search_results, catalogue=None):
+    results = [None] * len(refs)
+    found = [] # Indexes of located references, evaluated together
+    pairs = []
+    for i, (ref, res) in enumerate(zip(refs, search_results)):
+        if res is None:
+            results[i] = evaluate_result(evaluator, ref, None, catalogue)
+        else:
+            found.append(i)
+            pairs.append((ref, crossref.CrossrefParser().extract_ref(res)))
+    for i, (ref, found_ref), evaluation in zip(found, pairs, evaluator.evaluate_batch(pairs)):
+        results[i] = {'reference': ref, 'reference-located': found_ref, 'evaluation': evaluation}
+    return results
 
+"""
+Orders results by confidence, passing references first, then by overall score, unmatched references last
+Parameters:
+    results (list[dict]): Reference evaluations
+Returns:
+    list[dict]: Reference evaluations from most to least confident
+"""
+def rank_results(results):
+    def confidence(res):
+        evaluation = res['evaluation']
+        if not isinstance(evaluation, dict):
+            return (False, -1.0) # No reference found
+        return (evaluation['passed'], evaluation['overall'] if evaluation['overall'] is not None else 0.0)
+    return sorted(results, key=confidence, reverse=True)
+
+"""
+Builds the name of the results file
+Parameters:
+    file_name (str): Name of output file
+Returns:
+    str: Results file name without extension
+"""
+def results_file_name(file_name):
+    return file_name + (" - " if len(file_name) > 0 else "") + "verification results"
 
 """
 Run full evaluator
@@ -391,22 +744,196 @@ Parameters:
     config (dict): Evaluation configuration
     mailto (str): Email address required for crossref api
     file_name (str): Name of output file (optional)
+    catalogue (ReferenceIndex): Local collection searched when Crossref finds no match (optional)
+    searcher (CrossrefSearcher): Searcher to reuse between runs (optional)
+    export (bool): Saves results as a JSON file when True (optional)
 Returns:
     dict: all reference evaluations
 """
-def evaluate_bibliography(bibliography, config, mailto, file_name=""):
+def evaluate_bibliography(bibliography, config, mailto, file_name="", catalogue=None, searcher=None, export=True):
     evaluator = EvaluationController(config) # Load evaluation settings onto controller
-    parsed_bib = parser.XmlBibliography().parse(bibliography) # Parses into Reference objects
-    results = []
+    parsed_bib = parser.XmlBibliography(evaluator.fields()).parse(bibliography) # Parses into lazily extracted Reference objects
+    return evaluate_references(evaluator, parsed_bib, mailto, file_name, catalogue, searcher, export)
+
+"""
+Run full evaluator on already parsed references, e.g. those streamed from Grobid by PdfToXML.stream
+Parameters:
+    evaluator (EvaluationController): Evaluation settings
+    refs (list[Reference]): Parsed references
+    mailto (str): Email address required for crossref api
+    file_name (str): Name of output file (optional)
+    catalogue (ReferenceIndex): Local collection searched when Crossref finds no match (optional)
+    searcher (CrossrefSearcher): Searcher to reuse between runs (optional)
+    export (bool): Saves results as a JSON file when True (optional)
+Returns:
+    dict: all reference evaluations
+"""
+def evaluate_references(evaluator, refs, mailto, file_name="", catalogue=None, searcher=None, export=True):
+    if searcher is None:
+        searcher = crossref.CrossrefSearcher(mailto, 20)
+    search_results = [searcher.search(ref) for ref in refs] # Initiates searches
+    results = evaluate_results(evaluator, refs, search_results, catalogue)
+
+    print("finished, returning results")
+    if export:
+        utils.export_json(results, results_file_name(file_name)) # exports results as JSON
+    return results
+
+"""
+Parses a bibliography and extracts every field up front, so later field reads do not touch the soup
+Parameters:
+    evaluator (EvaluationController): Evaluation settings, deciding which fields are extracted
+    bibliography (BeautifulSoup): XML file of bibliography as soup parser object
+Returns:
+    list[LazyReference]: all parsed references, fully extracted
+"""
+def parse_eagerly(evaluator, bibliography):
+    parsed_bib = parser.XmlBibliography(evaluator.fields()).parse(bibliography)
     for ref in parsed_bib:
-        search_results = crossref.CrossrefSearcher(mailto, 20).search(ref) # Initiates search
-        if search_results is not None:
-            found_ref = crossref.CrossrefParser().extract_ref(search_results)
-            evaluation = evaluator.evaluate(ref, found_ref)
-            results.append({'reference': ref, 'reference-located': found_ref, 'evaluation': evaluation})
-        else:
-            results.append({'reference': ref, 'reference-located': 'None Found', 'evaluation': 'None'}) # If no reference is found
+        ref.materialise()
+    return parsed_bib
+
+"""
+Run full evaluator asynchronously, searching for all references concurrently
+Cancelling the calling task cancels every outstanding search
+Parameters:
+    bibliography (BeautifulSoup): XML file of bibliography as soup parser object
+    config (dict): Evaluation configuration
+    mailto (str): Email address required for crossref api
+    file_name (str): Name of output file (optional)
+    deadline (float): Seconds allowed for the whole evaluation, raises TimeoutError when exceeded (optional)
+    limiter (asyncio.Semaphore): Concurrency budget shared with other evaluations (optional)
+    client (httpx.AsyncClient): HTTP client shared with other evaluations (optional)
+    catalogue (ReferenceIndex): Local collection searched when Crossref finds no match (optional)
+    searcher (AsyncCrossrefSearcher): Searcher shared with other evaluations, so identical searches are coalesced
+        across them, client and limiter are ignored when given (optional)
+    export (bool): Saves results as a JSON file when True, services running concurrent evaluations should pass False (optional)
+Returns:
+    dict: all reference evaluations
+"""
+async def evaluate_bibliography_async(bibliography, config, mailto, file_name="", deadline=None, limiter=None, client=None,
+                                      catalogue=None, searcher=None, export=True):
+    evaluator = EvaluationController(config)
+    parsed_bib = await asyncio.to_thread(parse_eagerly, evaluator, bibliography) # Parsing would block the event loop
+
+    owned = searcher is None # A searcher passed in is left open for the caller's other evaluations
+    if owned:
+        searcher = crossref.AsyncCrossrefSearcher(mailto, 20, client, limiter)
+    try:
+        async with asyncio.timeout(deadline): # No deadline when None
+            async with asyncio.TaskGroup() as tg: # Remaining searches are cancelled if one task fails
+                tasks = [tg.create_task(searcher.search(ref)) for ref in parsed_bib]
+    finally:
+        if owned:
+            await searcher.aclose()
+
+    results = await asyncio.to_thread(evaluate_results, evaluator, parsed_bib, [task.result() for task in tasks], catalogue)
 
     print("finished, returning results")
-    utils.export_json(results, file_name + (" - " if len(file_name) > 0 else "") + "verification results") # exports results as JSON
+    if export:
+        await asyncio.to_thread(utils.export_json, results, results_file_name(file_name)) # Keeps file I/O off the event loop
     return results
+
+"""
+Empties the memoised title and journal normalisation caches
+Parameters: None
+Returns: None
+"""
+def clear_normalisation_caches():
+    utils.normalise_str.cache_clear()
+    journals.journal_key.cache_clear()
+
+"""
+Creates the default searcher of the bounded memory evaluator, with its own small cache instead of the process wide one
+Parameters:
+    mailto (str): Email address required for crossref api
+Returns:
+    CrossrefSearcher: Searcher whose cache holds at most STREAM_CACHE_ENTRIES stage outcomes
+"""
+def stream_searcher(mailto):
+    return crossref.CrossrefSearcher(mailto, 20, TTLCache(STREAM_CACHE_ENTRIES))
+
+"""
+Run full evaluator with bounded memory, for bibliographies too large to hold in memory at once
+References are streamed from the XML file, searched by a pool of threads and written to the results file
+as soon as they are evaluated, in bibliography order. At most max_in_flight references are held between
+parsing and writing, parsing pauses while that many are waiting. The normalisation caches are cleared every
+STREAM_CLEAR_INTERVAL references, so they do not grow with the bibliography either.
+Parameters:
+    source (str | Path | file): Grobid XML file path or binary file object
+    config (dict): Evaluation configuration
+    mailto (str): Email address required for crossref api
+    file_name (str): Name of output file (optional)
+    max_in_flight (int): Maximum number of references held at once (optional)
+    lookup_workers (int): Number of concurrent searches (optional)
+    searcher (CrossrefSearcher): Searcher shared by the lookup threads, by default one with its own small cache (optional)
+Returns:
+    int: Number of references evaluated
+"""
+def evaluate_bibliography_stream(source, config, mailto, file_name="", max_in_flight=100, lookup_workers=4, searcher=None):
+    evaluator = EvaluationController(config)
+    if searcher is None:
+        searcher = stream_searcher(mailto)
+    clear_normalisation_caches()
+    in_flight = threading.Semaphore(max_in_flight) # Backpressure from the writer to the parser
+    stopped = threading.Event() # Set when the writer fails, so the other threads stop early
+    pending = queue.Queue()
+    located = queue.Queue()
+
+    def parse():
+        try:
+            for index, ref in enumerate(parser.XmlBibliography(evaluator.fields()).iter_parse(source)):
+                in_flight.acquire() # Waits until an earlier reference has been written
+                if stopped.is_set():
+                    break
+                pending.put((index, ref))
+        except Exception as e:
+            located.put(e) # Parse errors are raised by the writer
+        finally:
+            for _ in range(lookup_workers):
+                pending.put(None)
+
+    def lookup():
+        try:
+            while (item := pending.get()) is not None:
+                if stopped.is_set():
+                    continue # Drains the queue up to the sentinel
+                index, ref = item
+                located.put((index, ref, searcher.search(ref)))
+        except Exception as e:
+            located.put(e) # Search errors are raised by the writer
+        finally:
+            located.put(None)
+
+    threads = [threading.Thread(target=parse, daemon=True)]
+    threads += [threading.Thread(target=lookup, daemon=True) for _ in range(lookup_workers)]
+    for thread in threads:
+        thread.start()
+
+    waiting = {} # Evaluated results waiting for an earlier reference, at most max_in_flight
+    next_index = 0
+    finished = 0
+    try:
+        with utils.JsonArrayWriter(results_file_name(file_name)) as writer:
+            while finished < lookup_workers:
+                item = located.get()
+                if item is None:
+                    finished += 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                index, ref, search_results = item
+                waiting[index] = evaluate_result(evaluator, ref, search_results)
+                while next_index in waiting:
+                    writer.write(waiting.pop(next_index))
+                    next_index += 1
+                    in_flight.release()
+                    if next_index % STREAM_CLEAR_INTERVAL == 0:
+                        clear_normalisation_caches() # Bounded memory rather than hits on recurring titles
+    except BaseException:
+        stopped.set()
+        in_flight.release(max_in_flight) # Wakes the parser if it is waiting for the writer
+        raise
+
+    print("finished, evaluated", next_index, "references")
+    return next_index
@@ -0,0 +1,190 @@
+"""
+Journal title index for matching abbreviated and full journal names
+"""
+
+import functools
+import json
+import re
+import threading
+from pathlib import Path
+
+import utils
+
+JOURNALS_PATH = Path(__file__).resolve().parent.parent.joinpath("resources", "journal-abbreviations.json")
+STOP_WORDS = frozenset(("the", "of", "and", "on", "for", "in", "de", "der", "la")) # Dropped by ISO 4 abbreviations
+MIN_PREFIX = 3 # Shortest abbreviated word matched as a prefix, shorter ones are only matched through SHORT_WORDS
+SHORT_WORDS = {"j": "journal", "z": "zeitschrift"} # Standard ISO 4 abbreviations shorter than MIN_PREFIX
+ACRONYM = re.compile(r"\s*\(\s*([A-Z][A-Z0-9&]+)\s*\)\s*$") # Trailing acronym, e.g. "(TOPLAS)"
+
+"""
+Normalises a journal name into its index key, cached since the same journals recur across bibliographies
+Parameters:
+    name (str): Journal name
+Returns:
+    str: Lower case words without punctuation or stop words
+"""
+@functools.lru_cache(maxsize=65536)
+def journal_key(name):
+    return " ".join(word for word in utils.normalise_str(name).split() if word not in STOP_WORDS)
+
+"""
+Splits a trailing parenthesised acronym off a journal name
+Parameters:
+    name (str): Journal name, e.g. "ACM Transactions on Programming Languages and Systems (TOPLAS)"
+Returns:
+    tuple[str, str]: Name without the acronym and the acronym, None if the name has none
+"""
+def split_acronym(name):
+    match = ACRONYM.search(name)
+    if match is None or match.start() == 0:
+        return name, None
+    return name[:match.start()], match.group(1)
+
+"""
+Splits a journal name into words, marking the words abbreviated with a period (e.g. "Comput.")
+Parameters:
+    name (str): Journal name
+Returns:
+    list[tuple[str, bool]]: Lower case words without stop words, and whether each is abbreviated
+"""
+def abbreviated_words(name):
+    words = [(word, dot == ".") for word, dot in re.findall(r"([^\W_]+)(\.?)", name.lower())]
+    return [(word, dot) for word, dot in words if word not in STOP_WORDS]
+
+"""
+Checks whether an abbreviated word stands for a full word
+Parameters:
+    short (str): Abbreviated word, without its period
+    full (str): Full word
+Returns:
+    bool: True if short is a long enough prefix of full, or its standard abbreviation
+"""
+def abbreviates(short, full):
+    if len(short) < MIN_PREFIX:
+        return SHORT_WORDS.get(short) == full
+    return full.startswith(short)
+
+"""
+In-memory index mapping journal abbreviations and variants to canonical journal names
+Attributes:
+    entries(dict[str, list[str]]):
+        Canonical journal names and their abbreviations and variants, a name's trailing acronym is also indexed alone
+Methods:
+    key(name):
+        Normalises a journal name into its index key
+    canonical(name):
+        Returns the canonical name of a journal
+    matches(src, ext):
+        Checks whether two journal names refer to the same journal
+"""
+class JournalIndex:
+    def __init__(self, entries):
+        self.index = {}
+        for canonical, variants in entries.items():
+            for name in [canonical] + list(variants):
+                self.index[self.key(name)] = canonical
+                stripped, acronym = split_acronym(name)
+                if acronym is not None: # Listed names take precedence over the parts of another name
+                    self.index.setdefault(self.key(stripped), canonical)
+                    self.index.setdefault(self.key(acronym), canonical)
+
+    def __len__(self):
+        return len(self.index)
+
+    """
+    Normalises a journal name into its index key
+    Parameters:
+        name (str): Journal name
+    Returns:
+        str: Lower case words without punctuation or stop words
+    """
+    def key(self, name):
+        return journal_key(name)
+
+    """
+    Returns the canonical name of a journal, a name with a trailing acronym is also looked up without it and by it
+    Parameters:
+        name (str): Journal name, abbreviation or variant
+    Returns:
+        str: Canonical name, None if the journal is not in the index
+    """
+    def canonical(self, name):
+        canonical = self.index.get(self.key(name))
+        if canonical is None:
+            stripped, acronym = split_acronym(name)
+            if acronym is not None:
+                canonical = self.index.get(self.key(stripped)) or self.index.get(self.key(acronym))
+        return canonical
+
+    """
+    Checks whether two journal names refer to the same journal
+    Names match when they are the same or listed variants of the same indexed journal. A trailing parenthesised acronym
+    is ignored, e.g. "ACM Transactions on Programming Languages and Systems (TOPLAS)". When neither name is indexed
+    and at least one is abbreviated with periods, each word abbreviated with a period must be a prefix of at least
+    MIN_PREFIX letters of the corresponding word of the other name (e.g. J. Comput. Phys.), all other words must be equal
+    Parameters:
+        src (str): Source journal name
+        ext (str): External journal name
+    Returns:
+        bool: True if the names match
+    """
+    def matches(self, src, ext):
+        src_key, ext_key = self.key(src), self.key(ext)
+        if not src_key or not ext_key:
+            return False
+        if src_key == ext_key:
+            return True
+        src_canonical, ext_canonical = self.canonical(src), self.canonical(ext)
+        if src_canonical is not None or ext_canonical is not None: # An indexed journal only matches its own variants
+            return src_canonical == ext_canonical
+        (src, src_acronym), (ext, ext_acronym) = split_acronym(src), split_acronym(ext)
+        if self.key(src) == self.key(ext) or src_acronym is not None and self.key(src_acronym) == ext_key \
+                or ext_acronym is not None and self.key(ext_acronym) == src_key:
+            return True
+        src_words, ext_words = abbreviated_words(src), abbreviated_words(ext)
+        if len(src_words) != len(ext_words) or not any(dot for _, dot in src_words + ext_words):
+            return False
+        for (a, a_dot), (b, b_dot) in zip(src_words, ext_words):
+            if a == b:
+                continue
+            if a_dot and b_dot:
+                matched = abbreviates(a, b) or abbreviates(b, a)
+            elif a_dot:
+                matched = abbreviates(a, b)
+            elif b_dot:
+                matched = abbreviates(b, a)
+            else:
+                matched = False
+            if not matched:
+                return False
+        return True
+
+    """
+    Loads an index from a JSON file of canonical names and their variants
+    Parameters:
+        path (Path): Location of the JSON file
+    Returns:
+        JournalIndex: Loaded index
+    """
+    @classmethod
+    def load(cls, path=JOURNALS_PATH):
+        with open(path, encoding="utf8") as entries:
+            return cls(json.load(entries))
+
+
+default_index = None
+index_lock = threading.Lock()
+
+"""
+Returns the shared journal index, loading it on first use
+Parameters: None
+Returns:
+    JournalIndex: Index loaded from the bundled abbreviation list
+"""
+def journal_index():
+    global default_index
+    if default_index is None:
+        with index_lock:
+            if default_index is None:
+                default_index = JournalIndex.load()
+    return default_index
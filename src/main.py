@@ -5,8 +5,6 @@ Example project usage
 
 from pathlib import Path
 
-from bs4 import BeautifulSoup
-
 from parser import PdfToXML
 
 import os
@@ -17,7 +15,6 @@ mailto = os.getenv("MAILTO")
 
 path = Path.cwd().joinpath("resources", "test-data", "compressed.tracemonkey-pldi-09.pdf")
 
-result_path = path.with_suffix(".grobid.tei.xml")
 grobid_config = Path.cwd().joinpath("grobid-config.json")
 config_path = Path.cwd().joinpath("example-config.json")
 
@@ -59,11 +56,8 @@ example_config = {
 with open(config_path) as c:
     config = json.load(c)
 
+evaluator = evaluation.EvaluationController(config)
 pdftoXML = PdfToXML(path, path, grobid_config)
-parsed = pdftoXML.run()
-
-if parsed:
-    with open(result_path) as my_file:
-        soup = BeautifulSoup(my_file, "lxml-xml")
-        results = evaluation.evaluate_bibliography(soup, config, mailto, "compressed.tracemonkey-pldi-09")
+refs = list(pdftoXML.stream(fields=evaluator.fields(), keep_xml=False)) # keep_xml=True also writes the Grobid XML next to the PDF
+results = evaluation.evaluate_references(evaluator, refs, mailto, "compressed.tracemonkey-pldi-09")
 
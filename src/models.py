@@ -2,6 +2,9 @@
 Data Models
 """
 
+# Names of the bibliographic fields stored on a Reference
+REFERENCE_FIELDS = ("title", "author", "doi", "url", "date", "journal", "volume", "pages")
+
 """
 Object for storing reference data
 Attributes:
@@ -2,25 +2,54 @@
 Utilities for parsing data
 """
 
+import json
+import mmap
 import re
-from grobid_client.grobid_client import GrobidClient
+import struct
+import tarfile
+import time
+import zipfile
+from pathlib import Path
+
 import models as m
 
+STREAM_HEADER = struct.Struct(">I") # Length of a document ID in a length-prefixed stream
+STREAM_LENGTH = struct.Struct(">Q") # Length of a document in a length-prefixed stream
+GROBID_RETRIES = 5 # Times a busy Grobid server is retried before giving up
+
 """
 Converts pdf file into parsable XML
 Attributes:
     input_path (str): File path of the pdf to be parsed
     output_path (str): File path for the resulting XML file
     config_path (str): Location of Grobid config file
+    client (GrobidClient): Grobid client to reuse between runs (optional)
 Methods:
+    create_client:
+        Creates a Grobid client from the config file
     run:
         Calls the Grobid client to parse PDF
+    run_file:
+        Calls the Grobid client to parse only the input PDF
+    stream(pdf, fields, server, keep_xml, http):
+        Posts a PDF to Grobid and parses the references as the response arrives, without an intermediate file
 """
 class PdfToXML:
-    def __init__(self, input_path, output_path, config_path="./config.json"):
+    def __init__(self, input_path, output_path, config_path="./config.json", client=None):
         self.input_path = input_path
         self.output_path = output_path
         self.config_path = config_path
+        self.client = client
+
+    """
+    Creates a Grobid client from the config file
+    Parameters: None
+    Returns:
+        GrobidClient: client connected to the configured Grobid server
+    """
+    def create_client(self):
+        from grobid_client.grobid_client import GrobidClient # Imported on first use to keep start up fast
+        return GrobidClient(config_path=self.config_path)
 
     """
     Calls the Grobid client begin parsing
@@ -30,31 +59,196 @@ class PdfToXML:
     """
     def run(self):
         xml_path = self.input_path.with_suffix(".grobid.tei.xml") # File path of resulting xml
-        client = GrobidClient(config_path=self.config_path)
+        client = self.client if self.client is not None else self.create_client()
         client.process("processReferences", self.input_path.parent, self.output_path.parent, verbose=True) #Grobid configurations
         return (xml_path.is_file()) #Checks if XML file exists
 
+    """
+    Calls the Grobid client to parse only the input PDF, unlike run which parses its whole directory
+    Parameters: None
+    Returns:
+        bool: True if parsing was successful
+    """
+    def run_file(self):
+        xml_path = self.output_path.with_suffix(".grobid.tei.xml")
+        client = self.client if self.client is not None else self.create_client()
+        _, status, text = client.process_pdf("processReferences", str(self.input_path),
+                                             False, True, False, False, False, False, False) # Same options as run
+        if status != 200 or text is None:
+            print("Processing of", self.input_path, "failed with error", status)
+            return False
+        xml_path.write_text(text, encoding="utf8")
+        return True
+
+    """
+    Posts a PDF to Grobid's processReferences service and parses the references as the response arrives
+    The response body is fed straight into the parser, the XML only touches the disk when keep_xml is set.
+    Parameters:
+        pdf (bytes | file): PDF content, the input file is read when None (optional)
+        fields (set[str]): Reference fields to extract, all fields when None (optional)
+        server (str): Grobid server URL, overrides the config file's grobid_server (optional)
+        keep_xml (bool): Also writes the XML next to the output path (optional)
+        http (httpx.Client): HTTP client to reuse between documents (optional)
+        retries (int): Times a busy (503) server is retried after the config's sleep_time (optional)
+    Returns:
+        Iterator[Reference]: parsed references, in document order
+    Raises:
+        RuntimeError: If Grobid fails or is still busy after all retries
+    """
+    def stream(self, pdf=None, fields=None, server=None, keep_xml=False, http=None, retries=GROBID_RETRIES):
+        import httpx # Imported on first use to keep start up fast
+        with open(self.config_path) as c:
+            config = json.load(c)
+        url = (server or config["grobid_server"]).rstrip("/") + "/api/processReferences"
+        name = Path(self.input_path).name if self.input_path is not None else "input.pdf"
+        if pdf is None:
+            pdf = Path(self.input_path).read_bytes()
+        http = http if http is not None else httpx # The module level stream function matches Client.stream
+
+        for attempt in range(retries + 1):
+            with http.stream("POST", url, files={"input": (name, pdf, "application/pdf")}, data={"consolidateHeader": "1"},
+                             headers={"Accept": "text/plain"}, timeout=config.get("timeout", 60)) as response: # Same options as run
+                if response.status_code == 503: # Server busy, retried after the configured wait like the Grobid client
+                    response.read()
+                    if hasattr(pdf, "seek"):
+                        pdf.seek(0)
+                    if attempt < retries:
+                        time.sleep(config.get("sleep_time", 5))
+                    continue
+                if response.status_code != 200:
+                    response.read()
+                    raise RuntimeError("Processing of %s failed with error %s" % (name, response.status_code))
+                chunks = response.iter_bytes()
+                if keep_xml:
+                    chunks = tee_chunks(chunks, Path(self.output_path).with_suffix(".grobid.tei.xml"))
+                yield from XmlBibliography(fields).parse_chunks(chunks)
+                return
+        raise RuntimeError("Processing of %s failed, Grobid still busy after %d retries" % (name, retries))
+
+
+"""
+Passes chunks through while writing them to a file
+Parameters:
+    chunks (Iterator[bytes]): Chunks to pass through
+    path (Path): File the chunks are written to
+Returns:
+    Iterator[bytes]: The same chunks
+"""
+def tee_chunks(chunks, path):
+    with open(path, "wb") as output:
+        for chunk in chunks:
+            output.write(chunk)
+            yield chunk
+
+
+"""
+Reference view over a Grobid XML reference element
+Each field is extracted on first access and cached, fields outside the parser's field list are never extracted
+Attributes:
+    element (BeautifulSoup): Single reference XML Parser Soup object
+    parser (XmlBibliography): Parser supplying the field extractors
+Methods:
+    materialise:
+        Extracts all remaining fields and releases the XML element
+    encode:
+        Converts Reference object to dict for JSON export
+"""
+class LazyReference(m.Reference):
+    def __init__(self, element, parser):
+        self._element = element
+        self._parser = parser
+
+    def __getattr__(self, name): # Only called when the field has not been extracted or assigned yet
+        if name.startswith("_") or name not in m.REFERENCE_FIELDS:
+            raise AttributeError(name)
+        value = self._parser.extract_field(self._element, name) if self._element is not None else None
+        self.__dict__[name] = value # Caches the field so later access is a plain attribute lookup
+        return value
+
+    """
+    Extracts all remaining fields and releases the XML element
+    Parameters: None
+    Returns: None
+    """
+    def materialise(self):
+        if self._element is None:
+            return
+        for field in m.REFERENCE_FIELDS:
+            getattr(self, field)
+        self._element = None # Allows the soup to be freed once all references are materialised
+
+    """
+    Converts Reference object to dict for JSON export
+    Parameters: None
+    Returns:
+        dict: Attributes converted into key-value pairs
+    """
+    def encode(self):
+        self.materialise()
+        return {field: self.__dict__[field] for field in m.REFERENCE_FIELDS}
+
 
 """
 Converts Grobid XML file to data objects
-Attributes: None
+Attributes:
+    fields (set[str]): Reference fields to extract, all fields when None (optional)
 Methods:
+    extract_field (ref, field):
+        Extracts a single named field of a reference
     extract_text (ref, tag, attrib):
         Finds a specified XML tag and returns its text content
     parse_author (author):
         Transforms an individual author tag to an Author instance
     parse_author_list (ref):
         Extracts all authors of a reference
+    extract_title (ref):
+        Parses main title as a string
+    extract_doi (ref):
+        Parses DOI number as a string
+    extract_journal (ref):
+        Parses journal title as a string
     extract_year (ref):
         Parses publishing year as a string
+    extract_volume (ref):
+        Parses volume element as a string
     extract_pages (ref):
         Parses pages element as a string
     parse_ref (ref):
         Transforms an individual reference into a Reference object
     parse (soup):
-        Parses entire bibliography and returns a list of Reference instances
+        Parses entire bibliography and returns a list of lazily extracted Reference instances
+    iter_parse (source):
+        Streams references from an XML file without holding the whole document in memory
+    parse_chunks (chunks):
+        Streams references from XML arriving in chunks, such as an HTTP response body
 """
 class XmlBibliography:
+    def __init__(self, fields=None):
+        self.fields = set(fields) if fields is not None else None
+        self.extractors = { # Field name to extraction method
+            "title": self.extract_title,
+            "author": self.parse_author_list,
+            "doi": self.extract_doi,
+            "journal": self.extract_journal,
+            "date": self.extract_year,
+            "volume": self.extract_volume,
+            "pages": self.extract_pages
+        }
+
+    """
+    Extracts a single named field of a reference
+    Parameters:
+        ref (BeautifulSoup): XML reference Soup object
+        field (str): Name of the Reference attribute
+    Returns:
+        Parsed field, None if the field is not extracted by this parser
+    """
+    def extract_field(self, ref, field):
+        if self.fields is not None and field not in self.fields:
+            return None
+        extractor = self.extractors.get(field)
+        return extractor(ref) if extractor is not None else None
+
     """
     Finds a specified XML tag and returns its text content
     Parameters:
@@ -97,6 +291,36 @@ class XmlBibliography:
             auth_list.append(self.parse_author(auth))
         return auth_list
 
+    """
+    Parses main title as a string
+    Parameters:
+        ref (BeautifulSoup): XML reference Soup object
+    Returns:
+        str: title
+    """
+    def extract_title(self, ref):
+        return self.extract_text(ref, 'title', {'type':'main'})
+
+    """
+    Parses DOI number as a string
+    Parameters:
+        ref (BeautifulSoup): XML reference Soup object
+    Returns:
+        str: DOI
+    """
+    def extract_doi(self, ref):
+        return self.extract_text(ref, 'idno', {'type': 'DOI'})
+
+    """
+    Parses journal title as a string
+    Parameters:
+        ref (BeautifulSoup): XML reference Soup object
+    Returns:
+        str: journal title
+    """
+    def extract_journal(self, ref):
+        return self.extract_text(ref, 'title', {'level': 'j'})
+
     """
     Parses publishing year as a string
     Parameters:
@@ -113,6 +337,16 @@ class XmlBibliography:
         match = date_regx.match(date)
         return match.group('year') if match else None
 
+    """
+    Parses volume element as a string
+    Parameters:
+        ref (BeautifulSoup): XML reference Soup object
+    Returns:
+        str: volume
+    """
+    def extract_volume(self, ref):
+        return self.extract_text(ref, 'biblScope', {'unit': 'volume'})
+
     """
     Parses pages element as a string
     Parameters:
@@ -137,24 +371,292 @@ class XmlBibliography:
         Reference: a instance object with parsed elements 
     """
     def parse_ref(self, ref):
-        title = self.extract_text(ref, 'title', {'type':'main'})
-        authors = self.parse_author_list(ref)
-        doi = self.extract_text(ref, 'idno', {'type': 'DOI'})
-        date = self.extract_year(ref)
-        volume = self.extract_text(ref, 'biblScope', {'unit': 'volume'})
-        pages = self.extract_pages(ref)
-        return m.Reference(title, authors, doi, date=date, volume=volume, pages=pages)
+        fields = {field: self.extract_field(ref, field) for field in self.extractors}
+        return m.Reference(**fields)
 
     """
-    Parses entire bibliography and returns a list of Reference instances
+    Parses entire bibliography and returns a list of lazily extracted Reference instances
     Parameters:
         soup (BeautifulSoup): XML Parser Soup object of entire bibliography 
     Returns:
-        list[Reference]: all parsed references
+        list[LazyReference]: all parsed references
     """
     def parse(self, soup):
         bib = soup.find_all('biblStruct') # Name of a reference element tag on Grobid XML files
         parsed_bib = []
         for ref in bib:
-            parsed_bib.append(self.parse_ref(ref))
+            parsed_bib.append(LazyReference(ref, self))
         return parsed_bib
+
+    """
+    Streams references from an XML file without holding the whole document in memory
+    Each reference element is parsed on its own and removed from the partially built tree once yielded
+    Parameters:
+        source (str | Path | file): Grobid XML file path or binary file object
+    Returns:
+        Iterator[Reference]: parsed references, in document order
+    """
+    def iter_parse(self, source):
+        from lxml import etree # Imported on first use to keep start up fast
+        for _, element in etree.iterparse(source, events=("end",), tag="{*}biblStruct"):
+            yield self.parse_element(element)
+
+    """
+    Streams references from XML arriving in chunks, such as an HTTP response body
+    Parameters:
+        chunks (Iterator[bytes]): Consecutive parts of a Grobid XML document
+    Returns:
+        Iterator[Reference]: parsed references, in document order
+    """
+    def parse_chunks(self, chunks):
+        from lxml import etree
+        pull = etree.XMLPullParser(events=("end",), tag="{*}biblStruct")
+        for chunk in chunks:
+            pull.feed(chunk)
+            for _, element in pull.read_events():
+                yield self.parse_element(element)
+        pull.close() # Raises on a truncated document
+        for _, element in pull.read_events():
+            yield self.parse_element(element)
+
+    """
+    Parses a reference element of a partially built tree, then removes it and its parsed siblings from the tree
+    Parameters:
+        element (lxml.etree.Element): biblStruct element
+    Returns:
+        Reference: a instance object with parsed elements
+    """
+    def parse_element(self, element):
+        ref = self.parse_ref(ElementTag(element)) # Eager, so the reference does not keep the element alive
+        element.clear()
+        while element.getprevious() is not None: # Drops already parsed siblings from the tree
+            del element.getparent()[0]
+        return ref
+
+"""
+Read-only view of an lxml element offering the parts of the BeautifulSoup Tag API used by XmlBibliography's extractors,
+so streamed elements are read in place instead of being serialised and parsed again into a soup
+Attributes:
+    element (lxml.etree.Element): Viewed element
+Methods:
+    find(tag, attrs):
+        Returns the first descendant with a tag name and attribute values
+    find_all(tag, attrs):
+        Returns all descendants with a tag name and attribute values
+    has_attr(name):
+        Checks whether the element has an attribute
+    get(name, default):
+        Returns an attribute value
+"""
+class ElementTag:
+    def __init__(self, element):
+        self.element = element
+
+    @property
+    def text(self):
+        return "".join(self.element.itertext())
+
+    def __getitem__(self, name):
+        return self.element.attrib[name]
+
+    """
+    Returns the first descendant with a tag name and attribute values
+    Parameters:
+        tag (str): Tag name, without namespace
+        attrs (dict[str, str]): Attribute values the descendant must have (optional)
+    Returns:
+        ElementTag: Matching descendant, None if there is none
+    """
+    def find(self, tag, attrs=None):
+        return next(self.iter_matches(tag, attrs), None)
+
+    """
+    Returns all descendants with a tag name and attribute values
+    Parameters:
+        tag (str): Tag name, without namespace
+        attrs (dict[str, str]): Attribute values the descendants must have (optional)
+    Returns:
+        list[ElementTag]: Matching descendants, in document order
+    """
+    def find_all(self, tag, attrs=None):
+        return list(self.iter_matches(tag, attrs))
+
+    def iter_matches(self, tag, attrs):
+        for element in self.element.iterdescendants("{*}" + tag):
+            if not attrs or all(element.get(name) == value for name, value in attrs.items()):
+                yield ElementTag(element)
+
+    """
+    Checks whether the element has an attribute
+    Parameters:
+        name (str): Attribute name
+    Returns:
+        bool: True if the attribute is set
+    """
+    def has_attr(self, name):
+        return name in self.element.attrib
+
+    """
+    Returns an attribute value
+    Parameters:
+        name (str): Attribute name
+        default: Value returned when the attribute is not set (optional)
+    Returns:
+        str: Attribute value
+    """
+    def get(self, name, default=None):
+        return self.element.get(name, default)
+
+"""
+Reads many Grobid XML documents from one consolidated source without extracting them to disk
+Sources are tar archives (optionally compressed), zip archives or length-prefixed streams.
+A length-prefixed stream is a sequence of records, each made of a 4 byte big-endian ID length,
+the UTF-8 document ID, an 8 byte big-endian document length and the document bytes.
+Attributes:
+    source (str | Path | file): Archive or stream file path, or a binary file object holding a stream
+    fields (set[str]): Reference fields to extract, all fields when None (optional)
+Methods:
+    documents:
+        Yields the ID and XML content of each document
+    references:
+        Yields each parsed reference tagged with its document ID
+"""
+class TeiArchive:
+    def __init__(self, source, fields=None):
+        self.source = source
+        self.fields = fields
+
+    """
+    Yields the ID and XML content of each document
+    Parameters: None
+    Returns:
+        Iterator[tuple[str, bytes | file]]: Document ID and content
+    """
+    def documents(self):
+        if not isinstance(self.source, (str, Path)):
+            yield from self.read_stream(self.source)
+        elif tarfile.is_tarfile(self.source):
+            with tarfile.open(self.source, "r:*") as archive: # Detects compression
+                for member in archive:
+                    if member.isfile() and member.name.endswith(".xml"):
+                        with archive.extractfile(member) as xml:
+                            yield member.name, xml
+        elif zipfile.is_zipfile(self.source):
+            with zipfile.ZipFile(self.source) as archive:
+                for name in archive.namelist():
+                    if name.endswith(".xml"):
+                        with archive.open(name) as xml:
+                            yield name, xml
+        else:
+            with open(self.source, "rb") as stream:
+                if Path(self.source).stat().st_size == 0:
+                    return # Empty files cannot be memory-mapped
+                with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    yield from self.read_mapped(mapped)
+
+    """
+    Yields the documents of a memory-mapped length-prefixed stream
+    Parameters:
+        mapped (mmap): Memory-mapped stream
+    Returns:
+        Iterator[tuple[str, bytes]]: Document ID and content
+    Raises:
+        ValueError: If a record is cut short
+    """
+    def read_mapped(self, mapped):
+        offset = 0
+        while offset < len(mapped):
+            (id_length,) = STREAM_HEADER.unpack_from(mapped, self.check_record(mapped, offset, STREAM_HEADER.size))
+            offset += STREAM_HEADER.size
+            doc_id = mapped[self.check_record(mapped, offset, id_length):offset + id_length].decode("utf8")
+            offset += id_length
+            (length,) = STREAM_LENGTH.unpack_from(mapped, self.check_record(mapped, offset, STREAM_LENGTH.size))
+            offset += STREAM_LENGTH.size
+            self.check_record(mapped, offset, length)
+            yield doc_id, mapped[offset:offset + length] # Only this document is copied out of the mapping
+            offset += length
+
+    """
+    Checks that a record field lies within a memory-mapped stream
+    Parameters:
+        mapped (mmap): Memory-mapped stream
+        offset (int): Start of the field
+        length (int): Length of the field
+    Returns:
+        int: The offset
+    Raises:
+        ValueError: If the stream ends before the field does
+    """
+    def check_record(self, mapped, offset, length):
+        if offset + length > len(mapped):
+            raise ValueError("truncated stream, record at byte %d needs %d bytes but %d remain"
+                             % (offset, length, len(mapped) - offset))
+        return offset
+
+    """
+    Yields the documents of a length-prefixed stream read from a file object
+    Parameters:
+        stream (file): Binary file object
+    Returns:
+        Iterator[tuple[str, bytes]]: Document ID and content
+    Raises:
+        ValueError: If a record is cut short
+    """
+    def read_stream(self, stream):
+        while header := stream.read(STREAM_HEADER.size):
+            (id_length,) = STREAM_HEADER.unpack(self.read_exact(stream, STREAM_HEADER.size, header))
+            doc_id = self.read_exact(stream, id_length).decode("utf8")
+            (length,) = STREAM_LENGTH.unpack(self.read_exact(stream, STREAM_LENGTH.size))
+            yield doc_id, self.read_exact(stream, length)
+
+    """
+    Reads exactly n bytes from a file object
+    Parameters:
+        stream (file): Binary file object
+        n (int): Number of bytes
+        data (bytes): Bytes of the field already read (optional)
+    Returns:
+        bytes: n bytes
+    Raises:
+        ValueError: If the stream ends first
+    """
+    def read_exact(self, stream, n, data=b""):
+        while len(data) < n and (chunk := stream.read(n - len(data))):
+            data += chunk # Pipes and sockets may return fewer bytes than asked for
+        if len(data) < n:
+            raise ValueError("truncated stream, expected %d bytes but got %d" % (n, len(data)))
+        return data
+
+    """
+    Yields each parsed reference tagged with its document ID
+    Parameters: None
+    Returns:
+        Iterator[tuple[str, LazyReference]]: Document ID and reference
+    """
+    def references(self):
+        from bs4 import BeautifulSoup # Imported on first use to keep start up fast
+        bibliography = XmlBibliography(self.fields)
+        for doc_id, xml in self.documents():
+            soup = BeautifulSoup(xml, "lxml-xml")
+            for ref in bibliography.parse(soup):
+                yield doc_id, ref
+
+
+"""
+Writes Grobid XML documents as a length-prefixed stream readable by TeiArchive
+Parameters:
+    stream (file): Binary file object to write to
+    documents (Iterable[tuple[str, bytes]]): Document ID and content
+Returns:
+    int: Number of documents written
+"""
+def write_tei_stream(stream, documents):
+    count = 0
+    for doc_id, xml in documents:
+        encoded_id = doc_id.encode("utf8")
+        stream.write(STREAM_HEADER.pack(len(encoded_id)))
+        stream.write(encoded_id)
+        stream.write(STREAM_LENGTH.pack(len(xml)))
+        stream.write(xml)
+        count += 1
+    return count
@@ -0,0 +1,227 @@
+'''
+Profiling of a full evaluation run
+Splits a run into parse, lookup and evaluate stages and profiles each one separately.
+Runs offline against resources/test-data by default so investigations are reproducible.
+
+Usage:
+    python src/profiling.py --output profile/ --mode sampling
+'''
+
+import argparse
+import collections
+import contextlib
+import cProfile
+import json
+import pstats
+import sys
+import threading
+import time
+from pathlib import Path
+
+import crossref
+import evaluation
+import models as m
+import parser
+
+ROOT = Path(__file__).resolve().parent.parent
+TEST_DATA = ROOT.joinpath("resources", "test-data", "compressed.tracemonkey-pldi-09.grobid.tei.xml")
+
+"""
+Samples the call stack of a thread at a fixed interval and counts identical stacks per stage
+Attributes:
+    thread_id (int): Identifier of the thread to sample
+    interval (float): Seconds between samples
+    stage (str): Stage the samples are recorded under, nothing is recorded while None
+Methods:
+    start:
+        Starts sampling in a background thread
+    stop:
+        Stops sampling
+    collapsed(stage):
+        Returns a stage's samples in collapsed stack format
+"""
+class StackSampler:
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stage = None
+        self.stacks = collections.defaultdict(collections.Counter) # Stage name to stack counts
+        self.running = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.running.set()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running.clear()
+        self.thread.join()
+
+    def sample(self):
+        while self.running.is_set():
+            stage = self.stage
+            frame = sys._current_frames().get(self.thread_id) if stage is not None else None
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s:%s" % (Path(code.co_filename).name, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[stage][";".join(reversed(stack))] += 1 # Root first, as flamegraph tools expect
+            time.sleep(self.interval)
+
+    """
+    Returns a stage's samples in collapsed stack format, one "frame;frame;frame count" line per stack
+    Parameters:
+        stage (str): Stage name
+    Returns:
+        str: Collapsed stacks
+    """
+    def collapsed(self, stage):
+        return "".join("%s %d\n" % (stack, count) for stack, count in self.stacks[stage].most_common())
+
+"""
+Profiles named stages of a run and writes one profile per stage
+Attributes:
+    output_dir (Path): Directory for profile files
+    mode (str): "deterministic" writes cProfile .pstats files, "sampling" writes .collapsed stack files
+    interval (float): Seconds between samples in sampling mode
+Methods:
+    stage(name):
+        Context manager profiling the code run inside it as the named stage
+    write:
+        Writes the profile files
+    hotspots(top):
+        Returns the most expensive functions of each stage
+"""
+class StageProfiler:
+    def __init__(self, output_dir, mode="deterministic", interval=0.001):
+        if mode not in ("deterministic", "sampling"):
+            raise ValueError("unknown profiling mode %s" % mode)
+        self.output_dir = Path(output_dir)
+        self.mode = mode
+        self.interval = interval
+        self.profiles = {} # Stage name to cProfile profiler
+        self.sampler = None # Single sampler shared by all stages
+        self.seconds = collections.Counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.mode == "deterministic":
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+            profile.enable()
+        else:
+            if self.sampler is None:
+                self.sampler = StackSampler(threading.get_ident(), self.interval)
+                self.sampler.start() # Started before the stage is set so its start up is not sampled
+            self.sampler.stage = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            if self.mode == "deterministic":
+                profile.disable()
+            else:
+                self.sampler.stage = None
+
+    """
+    Writes the profile files
+    Parameters: None
+    Returns:
+        list[Path]: Files written
+    """
+    def write(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        written = []
+        if self.mode == "deterministic":
+            for name, profile in self.profiles.items():
+                path = self.output_dir.joinpath(name + ".pstats")
+                profile.dump_stats(path)
+                written.append(path)
+        elif self.sampler is not None:
+            self.sampler.stop()
+            for name in self.seconds:
+                path = self.output_dir.joinpath(name + ".collapsed")
+                path.write_text(self.sampler.collapsed(name), encoding="utf8")
+                written.append(path)
+        return written
+
+    """
+    Returns the most expensive functions of each stage
+    Deterministic profiles are ranked by time spent in the function itself,
+    sampled profiles by the number of samples with the function on top of the stack
+    Parameters:
+        top (int): Number of functions per stage
+    Returns:
+        dict[str, list[tuple[str, float]]]: Function and seconds (or samples) for each stage
+    """
+    def hotspots(self, top=10):
+        result = {}
+        for name in self.seconds:
+            if self.mode == "deterministic":
+                stats = pstats.Stats(self.profiles[name]).stats
+                ranked = sorted(stats.items(), key=lambda item: item[1][2], reverse=True) # Total time excluding sub calls
+                result[name] = [("%s:%d(%s)" % (Path(f).name, line, func), round(timing[2], 4))
+                                for (f, line, func), timing in ranked[:top]]
+            else:
+                leaves = collections.Counter()
+                for stack, count in self.sampler.stacks[name].items():
+                    leaves[stack.rsplit(";", 1)[-1]] += count
+                result[name] = leaves.most_common(top)
+        return result
+
+"""
+Runs a full evaluation split into profiled stages
+Parameters:
+    xml_path (Path): Grobid XML file
+    config (dict): Evaluation configuration
+    profiler (StageProfiler): Profiler recording each stage
+    searcher (CrossrefSearcher): Searcher, answers offline when None (optional)
+Returns:
+    list[dict]: all reference evaluations
+"""
+def profile_run(xml_path, config, profiler, searcher=None):
+    from bs4 import BeautifulSoup
+    searcher = searcher if searcher is not None else crossref.OfflineSearcher()
+    evaluator = evaluation.EvaluationController(config)
+
+    with profiler.stage("parse"):
+        with open(xml_path) as xml:
+            soup = BeautifulSoup(xml, "lxml-xml")
+        parsed_bib = parser.XmlBibliography(evaluator.fields()).parse(soup)
+        for ref in parsed_bib:
+            for field in m.REFERENCE_FIELDS: # Extracts lazy fields here so their cost is counted as parsing
+                getattr(ref, field)
+    with profiler.stage("lookup"):
+        search_results = [searcher.search(ref) for ref in parsed_bib]
+    with profiler.stage("evaluate"):
+        results = evaluation.evaluate_results(evaluator, parsed_bib, search_results)
+    return results
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(description="Profiles the parse, lookup and evaluate stages of an evaluation run")
+    args.add_argument("xml", nargs="?", default=str(TEST_DATA), help="Grobid XML file, the bundled test data by default")
+    args.add_argument("--config", default=str(ROOT.joinpath("example-config.json")))
+    args.add_argument("--output", default="profile", help="directory for profile files")
+    args.add_argument("--mode", choices=["deterministic", "sampling"], default="deterministic")
+    args.add_argument("--repeat", type=int, default=1, help="number of runs profiled together")
+    args.add_argument("--top", type=int, default=10, help="hotspots reported per stage")
+    args.add_argument("--mailto", default=None, help="searches Crossref instead of answering offline")
+    options = args.parse_args()
+
+    with open(options.config) as c:
+        config = json.load(c)
+    profiler = StageProfiler(options.output, options.mode)
+    searcher = crossref.CrossrefSearcher(options.mailto, 20) if options.mailto else None
+    for _ in range(options.repeat):
+        profile_run(options.xml, config, profiler, searcher)
+
+    for path in profiler.write():
+        print("written", path)
+    for name, hotspots in profiler.hotspots(options.top).items():
+        print("\n%s: %.3f s" % (name, profiler.seconds[name]))
+        for func, cost in hotspots:
+            print("    %-60s %s" % (func, cost))
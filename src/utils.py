@@ -2,6 +2,7 @@
 Utility helper functions
 """
 
+import functools
 import re
 import json
 
@@ -11,12 +12,14 @@ Removes special characters, normalises all whitespace characters with a uniform
 converts all letters to lower case and strips string of any 2+ whitespace sequences.
 Hyphens are replaced with whitespace so that hyphenated uniformly match with non-hypthened varients 
 (e.g. part-time & part time)
+Results are cached in-process, the same titles, authors and journals are normalised many times per run.
 
 Parameters:
     string (str): string to be normalised
 Returns:
      str: string with normalisation applied
  """
+@functools.lru_cache(maxsize=65536)
 def normalise_str(string):
     return re.sub(r'\s+', " ", # normalises all remaining whitespace characters with a single whitespace
                   re.sub(r'[^\w\s]', "", # Removes all special characters (All except whitespace and alphanumerical)
@@ -24,6 +27,17 @@ def normalise_str(string):
                                 re.sub(r'[\-\–—‒‑]', " ", string.lower().strip())))) # Replace all dashes with whitespace
 
 
+"""
+Converts data to a json string
+Parameters:
+    data (dict): data to be converted
+Returns:
+    str: JSON formatted string
+"""
+def to_json(data, indent=None):
+    return json.dumps(data, default=lambda o: o.encode(), indent=indent) # class objects require an encode method to convert into dict
+
+
 """
 Converts dict to json format and saves file onto file system
 Parameters:
@@ -35,3 +49,37 @@ def export_json(data, filename):
     with open(f"{filename}.json", "w") as json_file:
         json.dump(data, json_file, default=lambda o: o.encode(), indent=4) # class objects require an encode method to convert into dict
         print(f"Data saved to {filename}.json")
+
+
+"""
+Writes a JSON array one item at a time, so the whole array never has to be held in memory
+Attributes:
+    filename (str): name of the output file, without extension
+Methods:
+    write(item):
+        Appends an item to the array
+"""
+class JsonArrayWriter:
+    def __init__(self, filename):
+        self.filename = filename
+        self.count = 0
+
+    def __enter__(self):
+        self.file = open(f"{self.filename}.json", "w")
+        self.file.write("[")
+        return self
+
+    """
+    Appends an item to the array
+    Parameters:
+        item (dict): item to be exported
+    Returns: None
+    """
+    def write(self, item):
+        self.file.write(("," if self.count else "") + "\n" + to_json(item, indent=4))
+        self.count += 1
+
+    def __exit__(self, *exc):
+        self.file.write("\n]")
+        self.file.close()
+        print(f"Data saved to {self.filename}.json")
@@ -0,0 +1,49 @@
+"""
+Tests for matching references against a local catalogue
+Run from the project root with: python -m unittest discover tests
+"""
+
+import json
+import sys
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT.joinpath("src")))
+
+import catalogue
+import evaluation
+import models as m
+
+TITLE = "Trace-based just-in-time type specialization for dynamic languages"
+
+
+class CatalogueFallbackTest(unittest.TestCase):
+    def setUp(self):
+        with open(ROOT.joinpath("example-config.json")) as c:
+            self.evaluator = evaluation.EvaluationController(json.load(c))
+        self.source = m.Reference(TITLE, [m.Author("Andreas", "Gal")], "10.1145/1542476.1542528", date="2009")
+
+    def scores(self, result):
+        return {field: evaluation["score"] for field, evaluation in result["evaluation"]["reference element"].items()}
+
+    def test_record_without_doi(self):
+        index = catalogue.ReferenceIndex([m.Reference(TITLE, [m.Author("Andreas", "Gal")], None)])
+        result = evaluation.evaluate_result(self.evaluator, self.source, None, index)
+        self.assertIs(result["reference-located"], index.references[0])
+        self.assertEqual(self.scores(result)["doi"], "N/A")
+
+    def test_record_without_authors(self):
+        index = catalogue.ReferenceIndex([m.Reference(TITLE)])
+        result = evaluation.evaluate_result(self.evaluator, self.source, None, index)
+        self.assertEqual(self.scores(result)["author"], "N/A")
+        self.assertEqual(self.scores(result)["doi"], "N/A")
+
+    def test_no_candidate(self):
+        index = catalogue.ReferenceIndex([m.Reference("An unrelated survey of graph databases")])
+        result = evaluation.evaluate_result(self.evaluator, self.source, None, index)
+        self.assertEqual(result["reference-located"], "None Found")
+
+
+if __name__ == "__main__":
+    unittest.main()
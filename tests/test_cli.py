@@ -0,0 +1,50 @@
+"""
+Tests for the batch runner's output locations
+Run from the project root with: python -m unittest discover tests
+"""
+
+import json
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT.joinpath("src")))
+
+import cli
+import crossref
+
+TEST_XML = ROOT.joinpath("resources", "test-data", "compressed.tracemonkey-pldi-09.grobid.tei.xml")
+
+
+class OutputPathTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+        with open(ROOT.joinpath("example-config.json")) as c:
+            self.config = json.load(c)
+
+    def test_same_name_in_different_directories(self):
+        for folder in ("a", "b"):
+            self.dir.joinpath("in", folder).mkdir(parents=True)
+            shutil.copy(TEST_XML, self.dir.joinpath("in", folder, "paper.grobid.tei.xml"))
+        inputs = cli.collect_inputs([str(self.dir.joinpath("in"))])
+        runner = cli.BatchRunner(self.config, None, self.dir.joinpath("out"), searcher=crossref.OfflineSearcher())
+        summary = runner.run(inputs)
+        self.assertEqual(summary["documents"], 2)
+        results = sorted(p.relative_to(self.dir.joinpath("out")).parent for p in self.dir.joinpath("out").rglob("*.json"))
+        self.assertEqual(results, [Path("a"), Path("b")])
+
+    def test_pdf_output_keeps_relative_path(self):
+        runner = cli.BatchRunner(self.config, None, self.dir.joinpath("out"), searcher=crossref.OfflineSearcher())
+        runner.root = self.dir
+        output = runner.output_path(self.dir.joinpath("x", "y", "paper.pdf"))
+        self.assertEqual(output, self.dir.joinpath("out", "x", "y", "paper.pdf"))
+        self.assertTrue(output.parent.is_dir())
+
+
+if __name__ == "__main__":
+    unittest.main()
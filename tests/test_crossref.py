@@ -0,0 +1,196 @@
+"""
+Tests for the staged Crossref search and coalescing of identical searches, run against stand-in Crossref clients
+Run from the project root with: python -m unittest discover tests
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT.joinpath("src")))
+
+import cache
+import crossref
+import models as m
+
+TITLE = "Trace-based just-in-time type specialization for dynamic languages"
+
+"""
+Stand-in for habanero's Crossref client that waits out its timeout and then fails, like an unreachable server
+Attributes:
+    calls (list[float]): Timeout of each query made through any instance
+"""
+class TimingOutCrossref:
+    calls = []
+
+    def __init__(self, mailto=None, timeout=None):
+        self.timeout = timeout
+
+    def works(self, ids=None, **query):
+        TimingOutCrossref.calls.append(self.timeout)
+        time.sleep(self.timeout)
+        raise TimeoutError("timed out")
+
+
+class SearchBudgetTest(unittest.TestCase):
+    def setUp(self):
+        TimingOutCrossref.calls = []
+        self.searcher = crossref.CrossrefSearcher(None, 0.2, cache.TTLCache(100), budget=0.3)
+        self.searcher.transport = TimingOutCrossref
+        self.ref = m.Reference(TITLE, [m.Author("Andreas", "Gal")], "10.1145/1542476.1542528", date="2009")
+
+    def test_stages_share_one_budget(self):
+        start = time.monotonic()
+        self.assertIsNone(self.searcher.search(self.ref))
+        self.assertLess(time.monotonic() - start, 0.45)
+        self.assertEqual(TimingOutCrossref.calls[0], 0.2)
+        self.assertLessEqual(sum(TimingOutCrossref.calls), 0.3 + 1e-6)
+
+    def test_errors_are_cached(self):
+        self.searcher.budget = 1 # Every stage runs and fails, skipped stages would not be cached
+        self.searcher.search(self.ref)
+        self.assertEqual(len(TimingOutCrossref.calls), 3)
+        queries = len(TimingOutCrossref.calls)
+        start = time.monotonic()
+        self.assertIsNone(self.searcher.search(self.ref))
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(len(TimingOutCrossref.calls), queries)
+
+    def test_errors_use_their_own_ttl(self):
+        outcome = crossref.error_outcome(TimeoutError("timed out"))
+        self.assertTrue(crossref.is_error_outcome(outcome))
+        self.assertEqual(crossref.outcome_ttl(self.searcher, outcome), crossref.ERROR_TTL)
+        self.assertEqual(crossref.outcome_ttl(self.searcher, None), crossref.NEGATIVE_TTL)
+
+
+"""
+Stand-in for habanero's Crossref client that answers every query with one record
+Attributes:
+    queries (list[dict]): Arguments of each query made through any instance
+"""
+class FoundCrossref:
+    queries = []
+
+    def __init__(self, mailto=None, timeout=None):
+        pass
+
+    def works(self, ids=None, **query):
+        FoundCrossref.queries.append(dict(query, ids=ids))
+        record = {"DOI": ids or "10.5555/found", "title": [query.get("query_title")]}
+        return {"status": "ok", "message": record if ids else {"items": [record]}}
+
+
+class SearchWrapperTest(unittest.TestCase):
+    def setUp(self):
+        FoundCrossref.queries = []
+        self.searcher = crossref.CrossrefSearcher(None, 20, cache.TTLCache(100))
+        self.searcher.transport = FoundCrossref
+
+    def test_search_title(self):
+        result = self.searcher.search_title(TITLE, ["Gal", "Franz"])
+        self.assertEqual(result["title"], [TITLE])
+        self.assertEqual(FoundCrossref.queries[0]["query_author"], "Gal Franz")
+
+    def test_search_doi(self):
+        self.assertEqual(self.searcher.search_doi("10.1145/1542476.1542528")["DOI"], "10.1145/1542476.1542528")
+
+    def test_errors_return_none(self):
+        self.searcher.transport = TimingOutCrossref
+        self.searcher.stage_timeouts["doi"] = 0
+        self.assertIsNone(self.searcher.search_doi("10.1145/1542476.1542528"))
+
+
+class AsyncSingleFlightTest(unittest.TestCase):
+    def test_caller_after_cancellation_starts_a_new_call(self):
+        calls = []
+
+        async def fetch():
+            calls.append(len(calls))
+            if len(calls) > 1:
+                return "found"
+            try:
+                await asyncio.sleep(10)
+            finally:
+                await asyncio.sleep(0.05) # Slow unwinding, the task is not yet cancelled when the next caller arrives
+
+        async def run():
+            flight = crossref.AsyncSingleFlight()
+            first = asyncio.ensure_future(flight.do("key", fetch))
+            await asyncio.sleep(0)
+            first.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+            return await flight.do("key", fetch)
+
+        self.assertEqual(asyncio.run(run()), "found")
+        self.assertEqual(len(calls), 2)
+
+    def test_callers_share_one_call(self):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "found"
+
+        async def run():
+            flight = crossref.AsyncSingleFlight()
+            return await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(run()), ["found"] * 5)
+        self.assertEqual(len(calls), 1)
+
+
+"""
+Search cache recording the threads it is used from
+Attributes:
+    threads (set[Thread]): Threads that read or wrote the cache
+"""
+class ThreadRecordingCache(cache.TTLCache):
+    def __init__(self):
+        super().__init__(100)
+        self.threads = set()
+
+    def get(self, key):
+        self.threads.add(threading.current_thread())
+        return super().get(key)
+
+    def set(self, key, value, ttl):
+        self.threads.add(threading.current_thread())
+        super().set(key, value, ttl)
+
+
+class AsyncSearcherTest(unittest.TestCase):
+    def search_doi(self, doi, cache):
+        import httpx
+        paths = []
+
+        def answer(request):
+            paths.append(request.url.raw_path.decode())
+            return httpx.Response(200, json={"status": "ok", "message": {"DOI": doi}})
+
+        async def run():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(answer)) as client:
+                searcher = crossref.AsyncCrossrefSearcher(None, 5, client, cache=cache)
+                return await searcher.search(m.Reference(TITLE, doi=doi))
+
+        return asyncio.run(run()), paths
+
+    def test_doi_is_quoted(self):
+        result, paths = self.search_doi("10.1000/a?b#c%d", cache.TTLCache(100))
+        self.assertEqual(result["DOI"], "10.1000/a?b#c%d")
+        self.assertEqual(paths, ["/works/10.1000/a%3Fb%23c%25d"])
+
+    def test_cache_is_used_off_the_event_loop(self):
+        recording = ThreadRecordingCache()
+        self.search_doi("10.1145/1542476.1542528", recording)
+        self.assertTrue(recording.threads)
+        self.assertNotIn(threading.main_thread(), recording.threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
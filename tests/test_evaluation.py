@@ -0,0 +1,51 @@
+"""
+Tests for the overall score and pass state of reference evaluations
+Run from the project root with: python -m unittest discover tests
+"""
+
+import json
+import sys
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT.joinpath("src")))
+
+import evaluation
+import models as m
+
+TITLE = "Trace-based just-in-time type specialization for dynamic languages"
+
+
+class OverallScoreTest(unittest.TestCase):
+    def setUp(self):
+        with open(ROOT.joinpath("example-config.json")) as c:
+            self.config = json.load(c)
+        self.source = m.Reference(TITLE, [m.Author("Andreas", "Gal")], "10.1145/1542476.1542528", date="2009",
+                                  volume="44", pages="465-478")
+
+    def test_matching_record_passes(self):
+        result = evaluation.EvaluationController(self.config).evaluate(self.source, self.source)
+        self.assertTrue(result["passed"])
+        self.assertEqual(result["overall"], 1.0)
+
+    def test_matching_title_alone_fails(self):
+        wrong = m.Reference(TITLE, [m.Author("Jane", "Doe")], "10.1000/other", date="1999", volume="2", pages="1-2")
+        result = evaluation.EvaluationController(self.config).evaluate(self.source, wrong)
+        self.assertFalse(result["passed"])
+
+    def test_overall_threshold(self):
+        del self.config["doi"]["threshold"], self.config["author"]["threshold"]
+        wrong = m.Reference(TITLE, [m.Author("Jane", "Doe")], "10.1000/other", date="1999", volume="2", pages="1-2")
+        result = evaluation.EvaluationController(self.config).evaluate(self.source, wrong)
+        self.assertLess(result["overall"], self.config["overall"]["threshold"])
+        self.assertFalse(result["passed"])
+
+    def test_overall_entry_is_not_a_field(self):
+        evaluator = evaluation.EvaluationController(self.config)
+        self.assertNotIn("overall", evaluator.elements)
+        self.assertNotIn("overall", evaluator.fields())
+
+
+if __name__ == "__main__":
+    unittest.main()
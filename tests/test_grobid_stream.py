@@ -0,0 +1,153 @@
+"""
+Tests for streaming Grobid responses into the reference parser, run against a local stand-in Grobid server
+Run from the project root with: python -m unittest discover tests
+"""
+
+import http.server
+import json
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT.joinpath("src")))
+
+import crossref
+import daemon
+import parser
+
+TEST_XML = ROOT.joinpath("resources", "test-data", "compressed.tracemonkey-pldi-09.grobid.tei.xml")
+CHUNK_SIZE = 4096 # Small chunks so references are parsed while the response is still arriving
+
+"""
+Local stand-in for Grobid's processReferences service, answering with the bundled test XML in chunks
+Attributes:
+    xml (bytes): Response body
+    busy (int): Number of requests answered with 503 before the XML is sent
+Methods:
+    url:
+        Returns the server's base URL
+    close:
+        Stops the server
+"""
+class GrobidStandIn(http.server.ThreadingHTTPServer):
+    def __init__(self, xml, busy=0):
+        super().__init__(("127.0.0.1", 0), GrobidHandler)
+        self.xml = xml
+        self.busy = busy
+        self.requests = [] # Path and whether a PDF was uploaded, for each request
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_port
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class GrobidHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append((self.path, b"%PDF" in body))
+        if self.server.busy > 0:
+            self.server.busy -= 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(0, len(self.server.xml), CHUNK_SIZE):
+            chunk = self.server.xml[i:i + CHUNK_SIZE]
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args): # Keeps test output quiet
+        pass
+
+
+class StandInTest(unittest.TestCase):
+    def setUp(self):
+        self.xml = TEST_XML.read_bytes()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.pdf = self.dir.joinpath("paper.pdf")
+        self.pdf.write_bytes(b"%PDF-1.4 stand-in")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def start(self, busy=0):
+        server = GrobidStandIn(self.xml, busy)
+        self.addCleanup(server.close)
+        config = self.dir.joinpath("grobid-config.json")
+        config.write_text(json.dumps({"grobid_server": server.url(), "timeout": 10, "sleep_time": 0}))
+        return server, parser.PdfToXML(self.pdf, self.pdf, str(config))
+
+
+class StreamTest(StandInTest):
+    def test_references_match_parsing_the_file(self):
+        server, pdf = self.start()
+        with open(TEST_XML, "rb") as xml:
+            expected = [ref.encode() for ref in parser.XmlBibliography().iter_parse(xml)]
+        self.assertEqual([ref.encode() for ref in pdf.stream()], expected)
+        self.assertEqual(server.requests, [("/api/processReferences", True)])
+
+    def test_no_xml_written_by_default(self):
+        _, pdf = self.start()
+        list(pdf.stream())
+        self.assertFalse(self.dir.joinpath("paper.grobid.tei.xml").exists())
+
+    def test_keep_xml_writes_identical_bytes(self):
+        _, pdf = self.start()
+        list(pdf.stream(keep_xml=True))
+        self.assertEqual(self.dir.joinpath("paper.grobid.tei.xml").read_bytes(), self.xml)
+
+    def test_busy_server_is_retried(self):
+        server, pdf = self.start(busy=2)
+        self.assertEqual(len(list(pdf.stream(retries=2))), 21)
+        self.assertEqual(len(server.requests), 3)
+
+    def test_busy_server_retries_are_capped(self):
+        server, pdf = self.start(busy=10)
+        with self.assertRaises(RuntimeError):
+            list(pdf.stream(retries=2))
+        self.assertEqual(len(server.requests), 3)
+
+    def test_server_argument_overrides_config(self):
+        server, _ = self.start()
+        config = self.dir.joinpath("unreachable-config.json")
+        config.write_text(json.dumps({"grobid_server": "http://127.0.0.1:9", "timeout": 10}))
+        refs = list(parser.PdfToXML(self.pdf, self.pdf, str(config)).stream(server=server.url()))
+        self.assertEqual(len(refs), 21)
+
+
+class WorkerStreamTest(StandInTest):
+    def worker(self, **options):
+        self.start()
+        worker = daemon.EvaluationWorker(ROOT.joinpath("example-config.json"), None,
+                                         str(self.dir.joinpath("grobid-config.json")), **options)
+        worker.searcher = crossref.OfflineSearcher()
+        self.addCleanup(lambda: worker.client is not None and worker.client.close())
+        return worker
+
+    def test_pdf_job_is_streamed(self):
+        results = self.worker().run_job({"path": str(self.pdf)})
+        self.assertEqual(len(results), 21)
+        self.assertFalse(self.dir.joinpath("paper.grobid.tei.xml").exists())
+
+    def test_pdf_job_keeps_xml(self):
+        self.worker().run_job({"path": str(self.pdf), "keep_xml": True})
+        self.assertEqual(self.dir.joinpath("paper.grobid.tei.xml").read_bytes(), self.xml)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+"""
+Tests for matching abbreviated, acronym and full journal names
+Run from the project root with: python -m unittest discover tests
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT.joinpath("src")))
+
+import journals
+
+TOPLAS = "ACM Transactions on Programming Languages and Systems"
+
+
+class AcronymTest(unittest.TestCase):
+    def setUp(self):
+        self.index = journals.journal_index()
+
+    def test_trailing_acronym_is_ignored(self):
+        self.assertTrue(self.index.matches(TOPLAS + " (TOPLAS)", TOPLAS))
+        self.assertTrue(self.index.matches("ACM Trans. Program. Lang. Syst.", TOPLAS + " (TOPLAS)"))
+        self.assertEqual(self.index.canonical(TOPLAS + " (TOPLAS)"), TOPLAS)
+
+    def test_other_journal_with_acronym_does_not_match(self):
+        self.assertFalse(self.index.matches(TOPLAS + " (TOPLAS)", "Communications of the ACM"))
+
+    def test_acronyms_are_indexed(self):
+        index = journals.JournalIndex({"Journal of Unlisted Studies (JUS)": []})
+        self.assertEqual(index.canonical("JUS"), "Journal of Unlisted Studies (JUS)")
+        self.assertTrue(index.matches("Journal of Unlisted Studies", "JUS"))
+
+    def test_unindexed_names_with_acronyms(self):
+        self.assertTrue(self.index.matches("Journal of Rare Findings (JRF)", "J. Rare Find."))
+        self.assertTrue(self.index.matches("Journal of Rare Findings (JRF)", "JRF"))
+        self.assertFalse(self.index.matches("Journal of Rare Findings (JRF)", "Journal of Common Findings"))
+
+    def test_lower_case_parenthesis_is_kept(self):
+        self.assertEqual(journals.split_acronym("Journal de Physique (Paris)"), ("Journal de Physique (Paris)", None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+"""
+Tests for streamed reference parsing against parsing the whole document with BeautifulSoup
+Run from the project root with: python -m unittest discover tests
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT.joinpath("src")))
+
+import parser
+
+TEST_XML = ROOT.joinpath("resources", "test-data", "compressed.tracemonkey-pldi-09.grobid.tei.xml")
+
+"""
+Returns the fields of an encoded reference with authors as plain values, Author equality only compares family names
+"""
+def fields(ref):
+    return dict(ref, author=[(a.given, a.family) for a in ref["author"]] if ref["author"] is not None else None)
+
+class ElementParsingTest(unittest.TestCase):
+    def test_streamed_references_match_soup(self):
+        with open(TEST_XML) as xml:
+            expected = [ref.encode() for ref in parser.XmlBibliography().parse(BeautifulSoup(xml, "lxml-xml"))]
+        with open(TEST_XML, "rb") as xml:
+            streamed = [ref.encode() for ref in parser.XmlBibliography().iter_parse(xml)]
+        self.assertEqual(len(streamed), 21)
+        self.assertEqual([fields(ref) for ref in streamed], [fields(ref) for ref in expected])
+
+    def test_element_pages_and_names(self):
+        xml = (b'<TEI xmlns="http://www.tei-c.org/ns/1.0"><biblStruct><analytic><title level="a" type="main">A <hi>study</hi>'
+               b'</title><author><persName><forename type="first">Ada</forename><forename type="middle">K</forename>'
+               b'<surname>Lovelace</surname></persName></author></analytic><monogr><title level="j">J. Stud.</title>'
+               b'<imprint><biblScope unit="page" from="3" to="9"/><date when="1843-10-01"/></imprint></monogr></biblStruct></TEI>')
+        ref = next(parser.XmlBibliography().parse_chunks([xml]))
+        self.assertEqual(ref.title, "A study")
+        self.assertEqual((ref.author[0].given, ref.author[0].family), ("Ada K", "Lovelace"))
+        self.assertEqual((ref.journal, ref.pages, ref.date), ("J. Stud.", "3-9", "1843"))
+
+
+if __name__ == "__main__":
+    unittest.main()